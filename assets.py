@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_file_id(conn, sha256: str, kind: str, file_id: str, path: str) -> list:
+    # New content at path replaces the earlier uploads from it, returns the sha256 of those dropped
+    superseded = "FROM Assets WHERE path = ? AND kind = ? AND sha256 != ?"
+    stale = [sha for (sha,) in conn.execute(f"SELECT sha256 {superseded}", (path, kind, sha256))]
+    conn.execute(f"DELETE {superseded}", (path, kind, sha256))
+    conn.execute(
+        "INSERT OR REPLACE INTO Assets (sha256, kind, file_id, path) VALUES (?, ?, ?, ?)", (sha256, kind, file_id, path)
+    )
+    return stale
+
+
+def uploaded_file_id(message, kind: str) -> str:
+    if kind == "photo":
+        return message.photo[-1].file_id  # largest size
+    return getattr(message, kind).file_id
+
+
+class AssetRegistry:
+    """
+    Uploads each file to Telegram once and re-sends it by file_id afterwards.
+    file_ids are stored by content hash, so an edited file is uploaded again automatically,
+    and the upload replaces the file_ids kept for the path's earlier contents.
+    """
+
+    def __init__(self):
+        self._hashes = {}    # path -> (mtime_ns, size, sha256)
+        self._file_ids = {}  # (sha256, kind) -> file_id
+        self.uploads = 0
+        self.reuses = 0
+
+    async def load(self) -> None:
+        rows = await get_db().fetchall("SELECT sha256, kind, file_id FROM Assets")
+        self._file_ids = {(sha256, kind): file_id for sha256, kind, file_id in rows}
+
+    async def content_hash(self, path: str) -> str:
+        # Only re-hash when the file changed on disk
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        sha256 = await asyncio.to_thread(hash_file, path)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+        return sha256
+
+    async def send(self, path: str, kind: str, send):
+        """
+        Send path with send(file) where file is the cached file_id or an open file.
+        kind is the message attribute holding the upload ("photo", "document").
+        """
+        async def upload():
+            with open(path, "rb") as f:
+                return await send(f)
+
+        return await self._send(await self.content_hash(path), kind, send, upload, path)
+
+    async def send_bytes(self, data: bytes, filename: str, kind: str, send, path: str = None):
+        # Same as send() for content generated in memory, e.g. a rendered image.
+        # path names what the data is (one chat's timetable), filename when omitted.
+        sha256 = hashlib.sha256(data).hexdigest()
+        return await self._send(sha256, kind, send, lambda: send(InputFile(data, filename=filename)), path or filename)
+
+    async def _send(self, sha256: str, kind: str, send, upload, path: str):
+        file_id = self._file_ids.get((sha256, kind))
+        if file_id:
+            try:
+                message = await send(file_id)
+                self.reuses += 1
+                return message
+            except BadRequest as e:
+                # Telegram forgot the file (e.g. a different bot token), upload it again
+                logger.warning("Cached file_id for %s was rejected: %s", path, e)
+                self._file_ids.pop((sha256, kind), None)
+
+        message = await upload()
+        self.uploads += 1
+
+        file_id = uploaded_file_id(message, kind)
+        # Identical content at another path shares the row, that path just uploads again once
+        for stale in await get_db().run(store_file_id, sha256, kind, file_id, path):
+            self._file_ids.pop((stale, kind), None)
+        self._file_ids[(sha256, kind)] = file_id
+        return message
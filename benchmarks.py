@@ -0,0 +1,561 @@
+"""
+Benchmarks for the bot's hot paths, run without Telegram or the real schedule.db.
+
+    python benchmarks.py broadcast --chats 500 --throttle-rate 0.05
+    python benchmarks.py tenants --tenants 1000 --classes 20
+    python benchmarks.py import --rows 10000
+    python benchmarks.py render --classes 40 --renders 20
+    python benchmarks.py load --rate 20 --duration 30 --mix today=6,ct=2,add_class=1,conversation=1 --output load.json
+    python benchmarks.py load --stream load-stream.jsonl --concurrent-updates 1
+    python benchmarks.py micro --classes 1000 --tests 10000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+from telegram.error import RetryAfter
+
+
+class StubBot:
+    """Stands in for telegram.Bot: answers after a short delay and sometimes answers 429."""
+
+    def __init__(self, latency: float = 0.02, throttle_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.sent = 0
+        self.throttled = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        if random.random() < self.throttle_rate:
+            self.throttled += 1
+            raise RetryAfter(self.retry_after)
+        self.sent += 1
+
+
+def bench_broadcast(args) -> dict:
+    from broadcast import Broadcaster
+
+    bot = StubBot(latency=args.latency, throttle_rate=args.throttle_rate)
+    broadcaster = Broadcaster(global_rate=args.global_rate, concurrency=args.concurrency)
+
+    started = time.perf_counter()
+    results = asyncio.run(broadcaster.broadcast(bot, {chat_id: "digest" for chat_id in range(args.chats)}))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results.values():
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        "chats": args.chats,
+        "seconds": elapsed,
+        "messages_per_s": bot.sent / elapsed,
+        "throttled": bot.throttled,
+        "retries": broadcaster.retries,
+        "statuses": statuses,
+    }
+
+
+def bench_tenants(args) -> dict:
+    # The bot reads SCHEDULE_DB when database.py is imported, point it at a throwaway copy first
+    path = os.path.join(tempfile.mkdtemp(), "schedule.db")
+    os.environ["SCHEDULE_DB"] = path
+
+    from cache import DAYS
+    from migrations import migrate
+    import bot_script
+
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    with conn:
+        conn.execute("DELETE FROM Classes")
+        conn.execute("DELETE FROM Vacation")
+        classes = []
+        for chat_id in range(1, args.tenants + 1):
+            for i in range(args.classes):
+                start_minute = 480 + 60 * (i // len(DAYS) % 10)
+                classes.append((chat_id, DAYS[i % len(DAYS)], f"ICT {1100 + i}", start_minute, start_minute + 50))
+        conn.executemany(
+            "INSERT INTO Classes (chat_id, day, class_name, start_minute, end_minute) VALUES (?, ?, ?, ?, ?)", classes
+        )
+        conn.executemany("INSERT INTO Vacation (chat_id, toggle_mode) VALUES (?, 0)", [(chat_id,) for chat_id in range(1, args.tenants + 1)])
+    conn.close()
+
+    async def load_and_render():
+        await bot_script.load_timetable()
+        await bot_script.load_vacation()
+        bot_script.reminder_wheel.load(
+            await bot_script.connect_db().fetchall("SELECT id, chat_id, day, class_name, start_minute FROM Classes")
+        )
+        # One rendered message per chat and weekday, as after everyone asked for the whole week
+        week = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(7)]
+        for chat_id in range(1, args.tenants + 1):
+            for day in week:
+                await bot_script.cached_response(
+                    chat_id, ("day", "date", day.isoformat()),
+                    lambda: bot_script.render_days(chat_id, "date", [day]),
+                )
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    asyncio.run(load_and_render())
+    elapsed = time.perf_counter() - started
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    bot_script.connect_db().close()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "tenants": args.tenants,
+        "classes_per_tenant": args.classes,
+        "load_seconds": elapsed,
+        "bytes": allocated,
+        "bytes_per_tenant": allocated / args.tenants,
+        "timetable": bot_script.timetable_cache.stats(),
+        "rendered": bot_script.response_cache.stats(),
+    }
+
+
+def bench_import(args) -> dict:
+    from cache import DAYS
+    from database import Database
+    from migrations import migrate
+    from timetable_io import FIELDS, parse_timetable, import_classes
+
+    path = os.path.join(tempfile.mkdtemp(), "schedule.db")
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.close()
+    db = Database(path)
+
+    lines = [",".join(FIELDS)]
+    for i in range(args.rows):
+        start_minute = 480 + (i * 10) % 600
+        lines.append(f"{DAYS[i % 7]},ICT {1100 + i % 50},{start_minute // 60:02d}:{start_minute % 60:02d},23:00")
+    data = "\n".join(lines).encode()
+
+    started = time.perf_counter()
+    rows = parse_timetable(data, "timetable.csv")
+    parsed = time.perf_counter()
+    db.call(import_classes, 1, rows)
+    imported = time.perf_counter()
+
+    # The same rows one INSERT and commit at a time, the way /add_class adds them
+    baseline_rows = rows[:args.baseline_rows]
+    for row in baseline_rows:
+        db.call(import_classes, 2, [row])
+    baseline = time.perf_counter() - imported
+    db.close()
+
+    return {
+        "rows": args.rows,
+        "bytes": len(data),
+        "parse_seconds": parsed - started,
+        "import_seconds": imported - parsed,
+        "import_rows_per_s": args.rows / (imported - parsed),
+        "row_by_row_rows": len(baseline_rows),
+        "row_by_row_seconds": baseline,
+        "row_by_row_rows_per_s": len(baseline_rows) / baseline,
+    }
+
+
+def worker_max_rss() -> int:
+    # Peak resident memory of the render worker in KiB, Pillow's image buffers aren't seen by tracemalloc
+    import timetable_image  # noqa: F401  (loads Pillow)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_render(args) -> dict:
+    from cache import DAYS
+    from timetable_image import course_colours, render_timetable
+
+    timetable = {day: [] for day in DAYS}
+    for i in range(args.classes):
+        start_minute = 480 + 60 * (i // 6 % 10)
+        timetable[DAYS[i % 6]].append((f"ICT {1100 + i} COURSE {i}", start_minute, start_minute + 50))
+    colours = course_colours({name for classes in timetable.values() for name, _, _ in classes}, {})
+
+    # In the bot's own process, what the event loop would be blocked for
+    tracemalloc.start()
+    inline = []
+    for _ in range(args.renders):
+        started = time.perf_counter()
+        png = render_timetable(timetable, colours, "Class Schedule")
+        inline.append(time.perf_counter() - started)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    async def in_worker():
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        rss_idle = await loop.run_in_executor(pool, worker_max_rss)
+        startup = time.perf_counter() - started
+
+        # A ticker every 5 ms shows how long the loop is stalled while the worker renders
+        lags = []
+
+        async def ticker():
+            while True:
+                before = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - before - 0.005)
+
+        ticking = asyncio.create_task(ticker())
+        rounds = []
+        for _ in range(args.renders):
+            started = time.perf_counter()
+            await loop.run_in_executor(pool, render_timetable, timetable, colours, "Class Schedule")
+            rounds.append(time.perf_counter() - started)
+        ticking.cancel()
+        rss_peak = await loop.run_in_executor(pool, worker_max_rss)
+        pool.shutdown()
+        return startup, rounds, max(lags, default=0.0), rss_idle, rss_peak
+
+    startup, rounds, max_lag, rss_idle, rss_peak = asyncio.run(in_worker())
+    inline.sort()
+    rounds.sort()
+    return {
+        "classes": args.classes,
+        "png_bytes": len(png),
+        "inline_ms": {"mean": 1000 * sum(inline) / len(inline), "p95": 1000 * inline[int(0.95 * (len(inline) - 1))]},
+        "inline_traced_peak_bytes": traced_peak,
+        "worker_startup_ms": 1000 * startup,
+        "worker_ms": {"mean": 1000 * sum(rounds) / len(rounds), "p95": 1000 * rounds[int(0.95 * (len(rounds) - 1))]},
+        "max_loop_lag_ms": 1000 * max_lag,
+        "worker_rss_idle_kib": rss_idle,
+        "worker_rss_peak_kib": rss_peak,
+    }
+
+
+def best_per_call(fn, repeat: int) -> float:
+    # Seconds per call, the best of repeat rounds that each run long enough (0.2 s) for timeit
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def bench_micro(args) -> dict:
+    # bot_script opens nothing at import, but keep it away from the real schedule.db anyway
+    os.environ["SCHEDULE_DB"] = os.path.join(tempfile.mkdtemp(), "schedule.db")
+
+    from class_times import display_time, format_time, parse_time
+    from vacation import VacationState
+    from cache import DAYS
+    import bot_script
+
+    names = list(bot_script.course_emojis) + [f"ICT {1106 + i} ELECTIVE" for i in range(10)]
+    classes = []
+    for i in range(args.classes):
+        start_minute = 480 + (i * 50) % 600
+        classes.append((names[i % len(names)], start_minute, start_minute + 50))
+    minutes = [minute for _, start, end in classes for minute in (start, end)]
+    times = [format_time(minute) for minute in minutes]
+
+    today = date.today()
+    now = bot_script.clock.now()
+    tests = [
+        (i, (today + timedelta(days=i % 120)).isoformat(), names[i % len(names)].split()[-1], "Chapters 1-3")
+        for i in range(args.tests)
+    ]
+    tests.sort(key=lambda test: test[1])
+
+    # A chat on vacation with dates, the costliest is_vacation answer
+    chat_id = 1
+    bot_script.vacations[chat_id] = VacationState(
+        bot_script.tz, 1, (today - timedelta(days=3)).isoformat(), (today + timedelta(days=4)).isoformat()
+    )
+    # Rows as load_vacation reads them, one strptime and localize per date
+    vacation_rows = [
+        (1, (today + timedelta(days=i % 30)).isoformat(), (today + timedelta(days=i % 30 + 7)).isoformat())
+        for i in range(args.classes)
+    ]
+
+    cases = {
+        # name: (items per call, fn)
+        "format_schedule": (len(classes), lambda: bot_script.format_schedule(classes)),
+        "display_time": (len(minutes), lambda: [display_time(minute) for minute in minutes]),
+        "parse_time": (len(times), lambda: [parse_time(value) for value in times]),
+        "is_vacation": (1, lambda: bot_script.is_vacation(chat_id)),
+        "vacation_state": (len(vacation_rows), lambda: [VacationState(bot_script.tz, *row) for row in vacation_rows]),
+        "format_tests": (len(tests), lambda: bot_script.format_tests(tests, today)),
+        "next_fire_time": (len(classes), lambda: [
+            bot_script.reminder_wheel.next_fire_time(DAYS[i % 7], start, now) for i, (_, start, _) in enumerate(classes)
+        ]),
+    }
+    selected = args.cases or list(cases)
+    unknown = [name for name in selected if name not in cases]
+    if unknown:
+        raise SystemExit(f"unknown cases: {', '.join(unknown)} (choose from {', '.join(cases)})")
+    results = {}
+    for name in selected:
+        items, fn = cases[name]
+        seconds = best_per_call(fn, args.repeat)
+        results[name] = {"items": items, "ms_per_call": 1000 * seconds, "us_per_item": 1e6 * seconds / items}
+    return {"classes": args.classes, "tests": args.tests, "repeat": args.repeat, "cases": results}
+
+
+# Updates sent by one user in turn, each one after the reply to the previous
+LOAD_SCENARIOS = {
+    "today": ["/today"],
+    "tomorrow": ["/tomorrow"],
+    "week": ["/week"],
+    "ct": ["/ct"],
+    "add_class": ["/add_class MON Load 08:00 09:00"],
+    "conversation": ["/add_schedule", "TUE", "Load", "10:00", "11:00"],
+}
+
+
+def parse_mix(text: str) -> dict:
+    # "today=6,ct=2" -> {"today": 6.0, "ct": 2.0}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in LOAD_SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, choose from {', '.join(LOAD_SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def synthetic_stream(mix: dict, rate: float, duration: float, seed: int) -> list:
+    # Sessions arriving as a Poisson process, the same seed gives the same stream
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    stream = []
+    at = rng.expovariate(rate)
+    while at < duration:
+        scenario = rng.choices(names, weights)[0]
+        stream.append({"at": round(at, 4), "scenario": scenario, "texts": LOAD_SCENARIOS[scenario]})
+        at += rng.expovariate(rate)
+    return stream
+
+
+def read_stream(path: str) -> list:
+    # One session per line: {"at": seconds from the start, "scenario": name, "texts": [...]}
+    with open(path) as f:
+        return sorted((json.loads(line) for line in f if line.strip()), key=lambda entry: entry["at"])
+
+
+def seed_load_db(path: str, chats: list) -> None:
+    # Every chat gets the legacy group's timetable and a few upcoming tests, so /today and /ct have work to do
+    from migrations import migrate, LEGACY_CHAT_ID
+
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    with conn:
+        classes = conn.execute(
+            "SELECT day, class_name, start_time, end_time, start_minute, end_minute FROM Classes WHERE chat_id = ?",
+            (LEGACY_CHAT_ID,),
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO Classes (chat_id, day, class_name, start_time, end_time, start_minute, end_minute) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(chat_id, *row) for chat_id in chats for row in classes],
+        )
+        conn.executemany(
+            "INSERT INTO ClassTests (chat_id, test_date, subject, details) VALUES (?, ?, ?, ?)",
+            [
+                (chat_id, (date.today() + timedelta(days=3 * i + 1)).isoformat(), f"ICT {1101 + i}", "Load test")
+                for chat_id in chats for i in range(10)
+            ],
+        )
+    conn.close()
+
+
+def read_metrics(port: int) -> dict:
+    # The bot's /metrics as {"name{labels}": value}
+    body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10).read().decode()
+    samples = {}
+    for line in body.splitlines():
+        if line and not line.startswith("#"):
+            key, value = line.rsplit(" ", 1)
+            samples[key] = float(value)
+    return samples
+
+
+def db_contention(before: dict, after: dict) -> dict:
+    # What the database did between two scrapes, and how long queries waited for a pooled connection
+    def delta(key):
+        return after.get(key, 0) - before.get(key, 0)
+
+    operations = {}
+    for key in after:
+        if key.startswith("bot_db_query_seconds_count{") and delta(key):
+            count = delta(key)
+            operations[key.split('"')[1]] = {
+                "count": int(count),
+                "mean_ms": 1000 * delta(key.replace("_count{", "_sum{")) / count,
+            }
+    waits = delta("bot_db_pool_wait_seconds_count")
+    return {
+        "operations": operations,
+        "pool_waits": int(waits),
+        "pool_wait_mean_ms": 1000 * delta("bot_db_pool_wait_seconds_sum") / waits if waits else 0.0,
+        "pool_waits_over_1ms": int(waits - delta('bot_db_pool_wait_seconds_bucket{le="0.001"}')),
+        "errors": {key: int(delta(key)) for key in after if key.startswith("bot_db_errors_total") and delta(key)},
+    }
+
+
+def bench_load(args) -> dict:
+    from fake_telegram import HERE, FakeBotAPI, free_port, start_bot, summarize, wait_until_ready
+
+    if args.stream:
+        stream = read_stream(args.stream)
+    else:
+        stream = synthetic_stream(args.mix, args.rate, args.duration, args.seed)
+    if args.save_stream:
+        with open(args.save_stream, "w") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in stream)
+
+    api = FakeBotAPI()
+    api_url = api.start(free_port())
+    webhook_port, metrics_port = free_port(), free_port()
+    secret = "fake-secret"
+
+    workdir = tempfile.mkdtemp(prefix="load-")
+    db_path = os.path.join(workdir, "schedule.db")
+    shutil.copy(os.path.join(HERE, "schedule.db"), db_path)
+    # A chat runs one session at a time so replies can be matched to updates
+    chats = [2_000_000 + index for index in range(args.chats)]
+    seed_load_db(db_path, chats)
+
+    extra_env = {"METRICS_PORT": str(metrics_port)}
+    if args.concurrent_updates:
+        extra_env["CONCURRENT_UPDATES"] = str(args.concurrent_updates)
+    bot = start_bot(api_url, args.mode, db_path, webhook_port, secret, extra_env)
+    try:
+        wait_until_ready(api, args.mode, webhook_port)
+
+        idle = queue.Queue()
+        for chat_id in chats:
+            idle.put(chat_id)
+        latencies = {entry["scenario"]: [] for entry in stream}
+        counts = {"timeouts": 0, "late_sessions": 0}
+        lock = threading.Lock()
+
+        def session(entry: dict, chat_id: int):
+            try:
+                for text in entry["texts"]:
+                    replied = api.inject(chat_id, text, secret)
+                    if not replied.wait(args.timeout):
+                        with lock:
+                            counts["timeouts"] += 1
+                        return
+                    with lock:
+                        latencies[entry["scenario"]].append(replied.latency)
+            finally:
+                idle.put(chat_id)
+
+        before = read_metrics(metrics_port)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.chats) as pool:
+            for entry in stream:
+                delay = started + entry["at"] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                chat_id = idle.get()
+                # Every chat was still busy when the session was due, the bot is falling behind
+                if time.perf_counter() - started - entry["at"] > 0.1:
+                    counts["late_sessions"] += 1
+                pool.submit(session, entry, chat_id)
+        elapsed = time.perf_counter() - started
+        after = read_metrics(metrics_port)
+    finally:
+        bot.terminate()
+        bot.wait(10)
+        api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    every = [latency for values in latencies.values() for latency in values]
+    result = {
+        "mode": args.mode,
+        "concurrent_updates": args.concurrent_updates,
+        "stream": args.stream or {"mix": args.mix, "rate": args.rate, "duration": args.duration, "seed": args.seed},
+        "chats": args.chats,
+        "sessions": len(stream),
+        "updates": len(every),
+        **counts,
+        "seconds": elapsed,
+        "throughput_per_s": len(every) / elapsed,
+        "latency": summarize(every),
+        "scenarios": {scenario: summarize(values) for scenario, values in latencies.items()},
+        "db": db_contention(before, after),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="benchmark", required=True)
+
+    broadcast = commands.add_parser("broadcast", help="daily digest fan-out against a stub Bot")
+    broadcast.add_argument("--chats", type=int, default=500)
+    broadcast.add_argument("--latency", type=float, default=0.02, help="seconds per send_message")
+    broadcast.add_argument("--throttle-rate", type=float, default=0.05, help="fraction of sends answered with 429")
+    broadcast.add_argument("--global-rate", type=float, default=25.0, help="messages per second")
+    broadcast.add_argument("--concurrency", type=int, default=20)
+    broadcast.set_defaults(run=bench_broadcast)
+
+    tenants = commands.add_parser("tenants", help="memory of the per-chat caches for many chats")
+    tenants.add_argument("--tenants", type=int, default=1000)
+    tenants.add_argument("--classes", type=int, default=20, help="classes per chat")
+    tenants.set_defaults(run=bench_tenants)
+
+    timetable_import = commands.add_parser("import", help="/import of a large CSV timetable in one transaction")
+    timetable_import.add_argument("--rows", type=int, default=10000)
+    timetable_import.add_argument("--baseline-rows", type=int, default=1000, help="rows inserted one commit at a time")
+    timetable_import.set_defaults(run=bench_import)
+
+    render = commands.add_parser("render", help="timetable image drawing, inline and in the worker process")
+    render.add_argument("--classes", type=int, default=40)
+    render.add_argument("--renders", type=int, default=20)
+    render.set_defaults(run=bench_render)
+
+    load = commands.add_parser("load", help="mixed traffic replayed against the bot through a fake Bot API")
+    load.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    load.add_argument("--mix", type=parse_mix, default=parse_mix("today=6,ct=2,add_class=1,conversation=1"),
+                      help=f"scenario weights, scenarios: {', '.join(LOAD_SCENARIOS)}")
+    load.add_argument("--rate", type=float, default=20.0, help="sessions started per second")
+    load.add_argument("--duration", type=float, default=30.0, help="seconds of synthetic traffic")
+    load.add_argument("--seed", type=int, default=1)
+    load.add_argument("--stream", help="replay this JSON lines stream instead of synthetic traffic")
+    load.add_argument("--save-stream", help="write the replayed stream here, to replay it later with --stream")
+    load.add_argument("--chats", type=int, default=50, help="chats the sessions are spread over")
+    load.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for each reply")
+    load.add_argument("--concurrent-updates", type=int, help="CONCURRENT_UPDATES for the bot (1 = sequential)")
+    load.add_argument("--output", help="also write the result to this JSON file")
+    load.set_defaults(run=bench_load)
+
+    micro = commands.add_parser("micro", help="timeit of the formatting and date helpers on large inputs")
+    micro.add_argument("--classes", type=int, default=1000, help="classes formatted per call")
+    micro.add_argument("--tests", type=int, default=10000, help="tests listed per call")
+    micro.add_argument("--repeat", type=int, default=5, help="timeit rounds, the best one is reported")
+    micro.add_argument("cases", nargs="*", help="cases to run (default: all)")
+    micro.set_defaults(run=bench_micro)
+
+    args = parser.parse_args()
+    print(json.dumps(args.run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,37 @@
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import pytz
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from telegram import Update, Bot
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, ConversationHandler, MessageHandler, filters
+from apscheduler.triggers.cron import CronTrigger
+from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest
+from telegram.ext import (
+    ApplicationBuilder, CallbackQueryHandler, CommandHandler, ContextTypes, ConversationHandler, MessageHandler, filters,
+)
 import logging
 import time
 import random
 import asyncio
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from database import get_db
+from cache import DAYS, TimetableCache, ResponseCache
+from class_times import parse_time, format_time, display_time
+from migrations import migrate, explain_hot_queries, schema_version, LEGACY_CHAT_ID
+import queries
+from vacation import VacationState
+from update_processor import PerChatUpdateProcessor
+from assets import AssetRegistry
+from broadcast import Broadcaster
+from jobstore import SQLiteJobStore
+from timetable_io import parse_timetable, import_classes, export_csv, export_json
+from calendar_feed import build_calendar, write_atomic
+from timetable_image import Image, course_colours, render_timetable
+from reminders import ReminderWheel
+from clock import Clock
+from metrics import CollectedMetric, InstrumentedRequest, instrument_handlers, serve as serve_metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -18,6 +41,47 @@ logger = logging.getLogger()
 # Set up the GMT+6 timezone
 tz = pytz.timezone("Asia/Dhaka")  # GMT+6 timezone
 
+# Every "now" and "today" of the bot, in GMT+6
+clock = Clock(tz)
+
+# Scheduler for the daily digest and housekeeping jobs, stored in schedule.db so they survive restarts.
+# A run missed while the bot was down still fires within the grace time, once even if several were missed.
+scheduler = AsyncIOScheduler(
+    jobstores={"default": SQLiteJobStore()},
+    job_defaults={"coalesce": True, "misfire_grace_time": 3600},
+)
+
+# The running application, used by scheduled jobs (they can't carry it as a stored argument)
+application = None
+
+# Bot API connection, override TELEGRAM_API_URL to talk to a local server (e.g. fake_telegram.py).
+# BOT_TOKEN is required, main() refuses to start without it.
+BOT_TOKEN = os.environ.get("BOT_TOKEN")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+TELEGRAM_FILE_URL = os.environ.get("TELEGRAM_FILE_URL")
+
+# How updates reach the bot: "polling" (getUpdates) or "webhook" (Telegram POSTs to our HTTP server)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # public URL registered with setWebhook, including the path
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Chat subscribed to the daily digest on first start, the others opt in with /subscribe
+DIGEST_CHAT_ID = int(os.environ.get("DIGEST_CHAT_ID", LEGACY_CHAT_ID))
+
+# Minutes before each class to send a reminder to the subscribed chats, 0 = no reminders
+REMINDER_MINUTES = int(os.environ.get("REMINDER_MINUTES", "10"))
+
+# Updates processed at once (updates from the same chat always run one after another), 1 = sequential
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "32"))
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics), 0 = no endpoint
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+
 # Emoji mapping for courses
 course_emojis = {
     "ICT 1109 CHEMISTRY": "🧪",
@@ -31,46 +95,75 @@ course_emojis = {
 
 
 
-# def convert_to_12_hour_format(time_str: str) -> str:
-#     # Convert the time to 12-hour format with AM/PM
-#     time_obj = datetime.strptime(time_str, "%H:%M")
-#     return time_obj.strftime("%I:%M %p")
-def convert_to_12_hour_format(time_str: str) -> str:
-    try:
-        # Convert the time to 12-hour format with AM/PM
-        time_obj = datetime.strptime(time_str, "%H:%M")
-        return time_obj.strftime("%I:%M %p")
-    except ValueError:
-        logger.error(f"Invalid time format: {time_str}")
-        return "Invalid time"
+#---
 
+# Shared connection pool for the SQLite database
+def connect_db():
+    return get_db()
 
-# Example usage
-start_time_12hr = convert_to_12_hour_format("14:30")  # Output: "02:30 PM"
-end_time_12hr = convert_to_12_hour_format("16:30")    # Output: "04:30 PM"
+# Every chat has its own timetable, tests and vacation (the rows from before that belong to LEGACY_CHAT_ID)
 
-#---
+# (chat, weekday) -> sorted classes, so schedule commands don't touch the database
+timetable_cache = TimetableCache()
 
-def get_classes_for_day(day: str, sorted: bool = True):
+async def load_timetable() -> None:
+    rows = await connect_db().fetchall(
+        "SELECT chat_id, day, class_name, start_minute, end_minute FROM Classes ORDER BY chat_id, day, start_minute"
+    )
+    timetable_cache.replace_all(rows)
+
+async def fetch_classes_for_day(chat_id: int, day: str, sorted: bool = True):
+    query = """
+        SELECT class_name, start_minute, end_minute 
+        FROM Classes 
+        WHERE chat_id = ? AND day = ?
+    """
+    if sorted:
+        query += " ORDER BY start_minute"
+    return await connect_db().fetchall(query, (chat_id, day))
+
+async def get_classes_for_day(chat_id: int, day: str, sorted: bool = True):
+    if sorted:
+        classes = timetable_cache.get(chat_id, day)
+        if classes is not None:
+            return classes
     try:
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
-        query = """
-            SELECT class_name, start_time, end_time 
-            FROM Classes 
-            WHERE day = ?
-        """
-        if sorted:
-            query += " ORDER BY strftime('%H:%M', start_time)"
-        cursor.execute(query, (day,))
-        classes = cursor.fetchall()
+        classes = await fetch_classes_for_day(chat_id, day, sorted)
     except sqlite3.Error as e:
         logger.error("Database error: %s", e)
         return []
-    finally:
-        conn.close()
+    if sorted:
+        timetable_cache.put(chat_id, day, classes)
     return classes
 
+# Write-through: reload a chat's day after /add_class, /del_class, /del_all or the conversations change it
+async def refresh_classes_for_day(chat_id: int, day: str) -> None:
+    response_cache.bump(chat_id, "schedule")
+    try:
+        rows = await connect_db().fetchall(queries.CLASSES_FOR_DAY, (chat_id, day))
+    except sqlite3.Error as e:
+        logger.error("Database error: %s", e)
+        timetable_cache.invalidate(chat_id, day)
+        return
+    timetable_cache.put(chat_id, day, [(class_name, start_minute, end_minute) for _, class_name, start_minute, end_minute in rows])
+    reminder_wheel.set_day(chat_id, day, [(class_id, class_name, start_minute) for class_id, class_name, start_minute, _ in rows])
+
+# Reload a chat's whole timetable with one query after a bulk change like /import
+async def refresh_timetable(chat_id: int) -> None:
+    response_cache.bump(chat_id, "schedule")
+    try:
+        rows = await connect_db().fetchall(queries.CLASSES_FOR_CHAT, (chat_id,))
+    except sqlite3.Error as e:
+        logger.error("Database error: %s", e)
+        timetable_cache.invalidate(chat_id)
+        return
+    days = {day: [] for day in DAYS}
+    for class_id, day, class_name, start_minute, end_minute in rows:
+        days.setdefault(day, []).append((class_id, class_name, start_minute, end_minute))
+    for day, classes in days.items():
+        timetable_cache.put(chat_id, day, [(class_name, start_minute, end_minute) for _, class_name, start_minute, end_minute in classes])
+        reminder_wheel.set_day(chat_id, day, [(class_id, class_name, start_minute) for class_id, class_name, start_minute, _ in classes])
+
 # States for the conversation handler
 DAY, CLASS_NAME, START_TIME, END_TIME, DELETE_DAY, DELETE_CLASS = range(6)
 
@@ -89,81 +182,113 @@ DAY, CLASS_NAME, START_TIME, END_TIME, DELETE_DAY, DELETE_CLASS = range(6)
 
 # Function to format the schedule with emojis
 def format_schedule(classes):
-    response = ""
-    for class_name, start_time, end_time in classes:
+    lines = []
+    for class_name, start_minute, end_minute in classes:
         try:
-            start_time_12hr = convert_to_12_hour_format(start_time)
-            end_time_12hr = convert_to_12_hour_format(end_time)
-            emoji = course_emojis.get(class_name, "")
-            response += f"⏰ *{start_time_12hr} - {end_time_12hr}*:📚 {class_name}\n"
+            start_time_12hr = display_time(start_minute)
+            end_time_12hr = display_time(end_minute)
+            lines.append(f"⏰ *{start_time_12hr} - {end_time_12hr}*:📚 {class_name}\n")
         except Exception as e:
             logger.error(f"Error formatting schedule for {class_name}: {e}")
+    return "".join(lines)
+
+
+# Rendered schedule messages, identical for every user of a chat until its data changes
+response_cache = ResponseCache()
+
+# Return the chat's cached message for key, rendering it once per version stamp.
+# The message is kept until the expires date (GMT+6), by default until midnight.
+async def cached_response(chat_id: int, key: tuple, render, expires: date = None):
+    # Take the stamp before rendering so a concurrent change can't be cached under the new one
+    key = key + (response_cache.stamp(chat_id),)
+    response = response_cache.get(chat_id, key)
+    if response is None:
+        response = await render()
+        if expires is None:
+            expires = clock.tomorrow()
+        response_cache.put(chat_id, key, response, expires)
     return response
 
+# Stale dates are never requested again, drop the expired messages when the day rolls over in GMT+6
+async def evict_rendered_responses() -> None:
+    evicted = response_cache.evict_expired(clock.today())
+    logger.info("Rendered schedule cache: %d expired messages dropped at midnight", evicted)
 
-#vacation functions-----------------------------------------------------------------------------------------------------------------------------------
-
-
-def is_vacation() -> tuple[bool, str]:
-    conn = sqlite3.connect("schedule.db")
-    cursor = conn.cursor()
 
-    # Fetch vacation status and dates
-    cursor.execute("SELECT toggle_mode, start_date, end_date FROM Vacation LIMIT 1")
-    vacation_data = cursor.fetchone()
-    conn.close()
-
-    toggle_mode, start_date, end_date = vacation_data
+#vacation functions-----------------------------------------------------------------------------------------------------------------------------------
 
-    # Debugging: Print the fetched data
-    print(f"Vacation status: {toggle_mode}, Start Date: {start_date}, End Date: {end_date}")
 
-    # If vacation is toggled on, check if dates are available
-    if toggle_mode == 1:
-        if start_date and end_date:
-            now = datetime.now(tz)  # Get current time in GMT+6
+# Vacation rows kept in memory by chat, loaded at startup and updated by the vacation commands
+vacations = {}
 
-            # Convert start_date and end_date to datetime objects with timezone
-            start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-            start_date_obj = tz.localize(start_date_obj)  # Make it timezone-aware
+# Chats that never set a vacation share this one, which is always off
+NO_VACATION = VacationState(tz)
 
-            end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
-            end_date_obj = tz.localize(end_date_obj)  # Make it timezone-aware
+def vacation_state(chat_id: int) -> VacationState:
+    return vacations.get(chat_id, NO_VACATION)
 
-            # Check if today's date is within the vacation period
-            if start_date_obj <= now <= end_date_obj:
-                # Calculate the remaining time
-                delta = end_date_obj - now
-                days_remaining = delta.days
-                hours_remaining = delta.seconds // 3600  # Remaining hours after days
+def is_vacation(chat_id: int) -> tuple[bool, str]:
+    return vacation_state(chat_id).status(clock.now())
 
-                # If the remaining time is negative, vacation is over, toggle off vacation mode
-                if days_remaining < 0:
-                    conn = sqlite3.connect("schedule.db")
-                    cursor = conn.cursor()
-                    cursor.execute("UPDATE Vacation SET toggle_mode = 0 WHERE toggle_mode = 1")
-                    conn.commit()
-                    conn.close()
-                    return False, "🎉 Vacation is over! 🏫 Time to get back to studying! 🎓"
+async def load_vacation() -> None:
+    rows = await connect_db().fetchall("SELECT chat_id, toggle_mode, start_date, end_date FROM Vacation")
+    vacations.clear()
+    for chat_id, toggle_mode, start_date, end_date in rows:
+        vacations[chat_id] = VacationState(tz, toggle_mode, start_date, end_date)
+        schedule_vacation_end(chat_id)
 
-                return True, f"🎉🌴 Vacation mode: ON! No alarms, no stress, just chilling. 😎🛀\nYou've got {days_remaining} day(s) and {hours_remaining} hour(s) before the fun ends—make it count! ⏳\nAnd hey, don’t bother me, I’m on vacation too! But seriously, get that homework done before it’s too late. 📝😂"
+# The chat's row is created the first time it changes its vacation
+async def save_vacation(chat_id: int, toggle_mode: int, start_date: str = None, end_date: str = None) -> None:
+    await connect_db().execute(
+        """
+        INSERT INTO Vacation (chat_id, toggle_mode, start_date, end_date) VALUES (?, ?, ?, ?)
+        ON CONFLICT (chat_id) DO UPDATE
+        SET toggle_mode = excluded.toggle_mode, start_date = excluded.start_date, end_date = excluded.end_date
+        """,
+        (chat_id, toggle_mode, start_date, end_date),
+    )
+    vacations[chat_id] = VacationState(tz, toggle_mode, start_date, end_date)
+    response_cache.bump(chat_id, "vacation")
+    schedule_vacation_end(chat_id)
 
-            # If today is after the end date, mark vacation as over
-            if now > end_date_obj:
-                conn = sqlite3.connect("schedule.db")
-                cursor = conn.cursor()
-                cursor.execute("UPDATE Vacation SET toggle_mode = 0 WHERE toggle_mode = 1")
-                conn.commit()
-                conn.close()
-                return False, "🎉 Vacation is over! 🏫 Time to get back to studying! 🎓"
+# Class reminders --------------------------------------------------------------------------
 
-        return True, "🎉🌴 Vacation mode: ON! No alarms, no stress, just chilling.! The classes are on vacation, and so am I! 😎🎉"
+# One set of flood limits for everything the bot sends on its own (reminders and the daily digest)
+broadcaster = Broadcaster()
 
-    return False, ""
+# Sent to the chat that owns the class, if it is subscribed
+async def send_class_reminder(chat_id: int, class_name: str, start_minute: int) -> None:
+    if is_vacation(chat_id)[0]:
+        return
+    if not await connect_db().fetchone("SELECT 1 FROM Subscriptions WHERE chat_id = ? AND active = 1", (chat_id,)):
+        return
+    text = f"⏰ *{class_name}* starts at {display_time(start_minute)} (in {REMINDER_MINUTES} minutes)"
+    await broadcaster.send(application.bot, chat_id, text, parse_mode="Markdown")
 
+# One timer for the classes of every chat, see reminders.py
+reminder_wheel = ReminderWheel(clock, REMINDER_MINUTES, send_class_reminder)
 
+async def start_reminders() -> None:
+    reminder_wheel.load(await connect_db().fetchall("SELECT id, chat_id, day, class_name, start_minute FROM Classes"))
+    reminder_wheel.start()
 
+# Fired by the scheduler at the exact end of a chat's vacation
+async def end_vacation(chat_id: int) -> None:
+    await connect_db().execute("UPDATE Vacation SET toggle_mode = 0 WHERE chat_id = ? AND toggle_mode = 1", (chat_id,))
+    state = vacation_state(chat_id)
+    vacations[chat_id] = VacationState(tz, 0, state.start_date, state.end_date)
+    response_cache.bump(chat_id, "vacation")
+    logger.info("Vacation of chat %s is over, vacation mode turned off", chat_id)
 
+def schedule_vacation_end(chat_id: int) -> None:
+    job_id = f"vacation_end:{chat_id}"
+    state = vacation_state(chat_id)
+    if state.enabled and state.has_dates():
+        # A run_date in the past (e.g. the bot was down at the end) runs the job right away
+        run_date = max(state.end, clock.now())
+        scheduler.add_job(end_vacation, 'date', run_date=run_date, args=[chat_id], id=job_id, replace_existing=True)
+    elif scheduler.get_job(job_id):
+        scheduler.remove_job(job_id)
 
 
 
@@ -171,17 +296,10 @@ def is_vacation() -> tuple[bool, str]:
 #function to toggle vacation status
 
 async def toggle_vacation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect("schedule.db")
-    cursor = conn.cursor()
-
     # Toggle vacation mode
-    cursor.execute("SELECT toggle_mode FROM Vacation LIMIT 1")
-    current_mode = cursor.fetchone()[0]
-    new_mode = 0 if current_mode == 1 else 1
-    cursor.execute("UPDATE Vacation SET toggle_mode = ?", (new_mode,))
-
-    conn.commit()
-    conn.close()
+    state = vacation_state(update.effective_chat.id)
+    new_mode = 0 if state.enabled else 1
+    await save_vacation(update.effective_chat.id, new_mode, state.start_date, state.end_date)
 
     status = "enabled" if new_mode == 1 else "disabled"
     await update.message.reply_text(f"Vacation mode has been {status}.", parse_mode="Markdown")
@@ -208,18 +326,10 @@ async def set_vacation_dates(update: Update, context: ContextTypes.DEFAULT_TYPE)
         start_date_db = start_date_obj.strftime("%Y-%m-%d")
         end_date_db = end_date_obj.strftime("%Y-%m-%d")
 
-        # Debugging: Log the dates to verify
-        print(f"Setting vacation from {start_date_db} to {end_date_db}")
-
-        # Connect to the database
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
+        logger.info("Setting vacation of chat %s from %s to %s", update.effective_chat.id, start_date_db, end_date_db)
 
         # Update the vacation dates in the database and toggle vacation mode to enabled (1)
-        cursor.execute("UPDATE Vacation SET start_date = ?, end_date = ?, toggle_mode = ?",
-                       (start_date_db, end_date_db, 1))  # Set toggle_mode to 1 (vacation mode enabled)
-        conn.commit()
-        conn.close()
+        await save_vacation(update.effective_chat.id, 1, start_date_db, end_date_db)
 
         await update.message.reply_text(
             f"Vacation dates set from {start_date} to {end_date} and vacation mode is now enabled! 🎉",
@@ -232,7 +342,7 @@ async def set_vacation_dates(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     except sqlite3.Error as e:
         # Handle any SQLite errors
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         await update.message.reply_text("There was an issue with the database. Please try again later.", parse_mode="Markdown")
         return
 
@@ -246,15 +356,11 @@ async def set_vacation_dates(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 # Function to show vacation list from the database
-def show_vacations() -> str:
-    conn = sqlite3.connect("schedule.db")
-    cursor = conn.cursor()
-
-    # Fetch all vacation records from the Vacation table
-    cursor.execute("SELECT id, toggle_mode, start_date, end_date FROM Vacation")
-    vacation_data = cursor.fetchall()
-
-    conn.close()
+async def show_vacations(chat_id: int) -> str:
+    # Fetch the chat's vacation records from the Vacation table
+    vacation_data = await connect_db().fetchall(
+        "SELECT id, toggle_mode, start_date, end_date FROM Vacation WHERE chat_id = ?", (chat_id,)
+    )
 
     # Prepare the vacation list response
     if vacation_data:
@@ -270,7 +376,7 @@ def show_vacations() -> str:
 
 # Command handler function for /vacation_list
 async def vacation_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    response = show_vacations()
+    response = await show_vacations(update.effective_chat.id)
     await update.message.reply_text(response, parse_mode="Markdown")
 #end of vacation functions-----------------------------------------------------------------------------------------------------------------------------
 
@@ -278,209 +384,216 @@ async def vacation_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-#new function today class
+# Schedule commands ------------------------------------------------------------------
+# /today, /tomorrow, /sat ... /thu and /date all go through the same engine: resolve the date in GMT+6,
+# then render it from the cached timetable and one range query for the tests.
 
-async def todays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    
-    # Check if vacation is active
-    vacation_active, vacation_message = is_vacation()
-    if vacation_active:
-        await update.message.reply_text(vacation_message, parse_mode="Markdown")
-        return
-    
-    # Get the current time in GMT+6
-    now = datetime.now(tz)
-
-    # Format the day and date using the timezone
-    today_day_full = now.strftime("%A")  # Full name of the day (e.g., "Thursday")
-    today_day_abbr = now.strftime("%a").upper()  # Abbreviated name for fetching data (e.g., "THU")
-    today_date = now.strftime("%d-%m-%Y")
-    today_date1 = now.strftime("%Y-%m-%d")  # Format for database query
-    
-    # Cleanup old tests
-    cleanup_old_tests()
-    
-    # Fetch the classes for today, sorted by time
-    classes = get_classes_for_day(today_day_abbr)
+# Days ahead of today for the relative commands, weekday (Monday = 0) for the weekday commands
+RELATIVE_DAY_COMMANDS = {"today": 0, "tomorrow": 1}
+WEEKDAY_COMMANDS = {"sat": 5, "sun": 6, "mon": 0, "tue": 1, "wed": 2, "thu": 3}
 
-    # Fetch the class tests for today
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT subject, details FROM ClassTests WHERE test_date = ?", (today_date1,))
-    tests = cursor.fetchall()
-    conn.close()
+# How each kind of day is titled: schedule heading, no classes line, tests heading
+DAY_TITLES = {
+    "today": (
+        " *Today's Schedule ({date}, {day_name}):*\n\n",
+        "❌ *No classes scheduled for today ({date}, {day_name})* ❌",
+        "\n\n📝 *Class Tests Today:* \n",
+    ),
+    "tomorrow": (
+        " *Tomorrow's Schedule ({date}, {day_name}):*\n\n",
+        "❌ *No classes scheduled for tomorrow ({date}, {day_name})* ❌",
+        "\n\n*📝 Class Tests Tomorrow:*\n",
+    ),
+    "date": (
+        " *{day_name}'s Schedule ({date})*: \n\n",
+        "❌ *No classes scheduled for {day_name} ({date})* ❌",
+        "\n\n*📝 Class Tests on {day_name}:*\n",
+    ),
+}
 
-    # Format the response
+# Which day a command shows and how it's titled, None if /date got no valid date
+def resolve_schedule_day(command: str, args):
+    if command in RELATIVE_DAY_COMMANDS:
+        return command, clock.today() + timedelta(days=RELATIVE_DAY_COMMANDS[command])
+    if command in WEEKDAY_COMMANDS:
+        return "date", clock.next_weekday(WEEKDAY_COMMANDS[command])
+    try:
+        return "date", datetime.strptime(args[0], "%d-%m-%Y").date()
+    except (IndexError, ValueError):
+        return None
+
+# The whole week of a chat, loaded from the database with one query if any day isn't cached
+async def get_timetable(chat_id: int) -> dict:
+    timetable = {day: timetable_cache.get(chat_id, day) for day in DAYS}
+    if all(classes is not None for classes in timetable.values()):
+        return timetable
+    rows = await connect_db().fetchall(queries.CLASSES_FOR_CHAT, (chat_id,))
+    timetable = {day: [] for day in DAYS}
+    for _, day, class_name, start_minute, end_minute in rows:
+        timetable.setdefault(day, []).append((class_name, start_minute, end_minute))
+    for day, classes in timetable.items():
+        timetable_cache.put(chat_id, day, classes)
+    return timetable
+
+# Tests of a chat from first to last (inclusive) in one query, by YYYY-MM-DD date
+async def get_tests_between(chat_id: int, first: date, last: date) -> dict:
+    rows = await connect_db().fetchall(queries.TESTS_BETWEEN_DATES, (chat_id, first.isoformat(), last.isoformat()))
+    tests = {}
+    for test_date, subject, details in rows:
+        tests.setdefault(test_date, []).append((subject, details))
+    return tests
+
+def render_day(kind: str, day: date, classes, tests) -> str:
+    heading, no_classes, tests_heading = DAY_TITLES[kind]
+    titles = {"date": day.strftime("%d-%m-%Y"), "day_name": day.strftime("%A")}
     if not classes:
-        response = f"❌ *No classes scheduled for today ({today_date}, {today_day_full})* ❌"
+        response = no_classes.format(**titles)
     else:
-        response = f" *Today's Schedule ({today_date}, {today_day_full}):*\n\n"
-        response += format_schedule(classes)
-
-    # Add class tests to the response
+        response = heading.format(**titles) + format_schedule(classes)
     if tests:
-        response += "\n\n📝 *Class Tests Today:* \n"
+        response += tests_heading.format(**titles)
         response += "\n".join([f"{subject}: {details}" for subject, details in tests])
-    
+    return response
 
-    # Send the reply
-    await update.message.reply_text(response, parse_mode="Markdown")
+# Render consecutive days of a chat's schedule with at most one query for the classes and one for the tests
+async def render_days(chat_id: int, kind: str, days: list) -> list:
+    timetable = await get_timetable(chat_id)
+    tests = await get_tests_between(chat_id, days[0], days[-1])
+    return [
+        render_day(kind, day, timetable[DAYS[day.weekday()]], tests.get(day.isoformat())) for day in days
+    ]
+
+# Handles /today, /tomorrow, the weekday commands and /date DD-MM-YYYY
+async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    command = update.message.text.split()[0].lstrip("/").split("@")[0].lower()
+
+    resolved = resolve_schedule_day(command, context.args)
+    if resolved is None:
+        await update.message.reply_text("Usage: `/date DD-MM-YYYY`", parse_mode="Markdown")
+        return
+    kind, day = resolved
 
-    
-    
-    
-# Function to get tomorrow's schedule
-async def tomorrows_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Check if vacation is active
-    vacation_active, vacation_message = is_vacation()
+    vacation_active, vacation_message = is_vacation(chat_id)
     if vacation_active:
         await update.message.reply_text(vacation_message, parse_mode="Markdown")
         return
-    
-    # Calculate tomorrow's date and day
-    tomorrow_datetime = datetime.now(tz) + timedelta(days=1)
-    tomorrow_day_full = tomorrow_datetime.strftime("%A")  # Full name of the day (e.g., "Friday")
-    tomorrow_day_abbr = tomorrow_datetime.strftime("%a").upper()  # Abbreviated name for fetching data (e.g., "FRI")
-    tomorrow_date = tomorrow_datetime.strftime("%d-%m-%Y")
-    tomorrow_date1 = tomorrow_datetime.strftime("%Y-%m-%d")
-
-    # Cleanup old tests
-    cleanup_old_tests()
-
-    # Fetch the classes for tomorrow
-    classes = get_classes_for_day(tomorrow_day_abbr)
-
-    # Fetch class tests for tomorrow
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT subject, details FROM ClassTests WHERE test_date = ?", (tomorrow_date1,))
-    tests = cursor.fetchall()
-    conn.close()
-
-    # Format the response
-    if not classes:
-        response = f"❌ *No classes scheduled for tomorrow ({tomorrow_date}, {tomorrow_day_full})* ❌"
-    else:
-        response = f" *Tomorrow's Schedule ({tomorrow_date}, {tomorrow_day_full}):*\n\n"
-        response += format_schedule(classes)
 
-    # Include tests in the response
-    if tests:
-        response += f"\n\n*📝 Class Tests Tomorrow:*\n"
-        response += "\n".join([f"{subject}: {details}" for subject, details in tests])
-    
-    # Log the final response
-    logger.info(f"Response sent to user:\n{response}")
-    # Send the reply
-    await update.message.reply_text(response, parse_mode="Markdown")
-
-
-
-# Other daily schedule functions follow the same pattern as `todays_schedule` and `tomorrows_schedule`.
-# Function to get Saturday's schedule
-async def saturdays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    saturday_day = "SAT"
-    saturday_date = (datetime.now() + timedelta((5 - datetime.now().weekday()) % 7)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(saturday_day)
-
-    if not classes:
-        response = f"❌ *No classes scheduled for Saturday ({saturday_date})* ❌"
-    else:
-        response = f" *Saturday's Schedule ({saturday_date})*: \n\n"
-        response += format_schedule(classes)
+    async def render() -> str:
+        return (await render_days(chat_id, kind, [day]))[0]
 
+    response = await cached_response(chat_id, ("day", kind, day.isoformat()), render)
     await update.message.reply_text(response, parse_mode="Markdown")
 
-# Function to get Sunday's schedule
-async def sundays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    sunday_day = "SUN"
-    sunday_date = (datetime.now() + timedelta((6 - datetime.now().weekday()) % 7)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(sunday_day)
-    
-    if not classes:
-        response = f"❌ *No classes scheduled for Sunday ({sunday_date})* ❌"
-    else:
-        response = f" *Sunday's Schedule ({sunday_date})*: \n\n"
-        response += format_schedule(classes)
-    
-    
-    await update.message.reply_text(response, parse_mode="Markdown")
-
-# Function to get Monday's schedule
-async def mondays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    monday_day = "MON"
-    monday_date = (datetime.now() + timedelta((0 - datetime.now().weekday()) % 7)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(monday_day)
+# Split text into messages Telegram accepts, between days (blank lines) where possible, else between lines
+def split_message(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> list:
+    chunks = []
+    current = ""
+    for block in text.split("\n\n"):
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        current = ""
+        # A single day longer than a message, fall back to whole lines (cut a line only if it alone is too long)
+        for line in block.split("\n"):
+            while len(line) > limit:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(line[:limit])
+                line = line[limit:]
+            candidate = f"{current}\n{line}" if current else line
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+# The week runs Saturday to Friday, on Friday (the weekend) /week shows the coming one
+def week_start(today: date) -> date:
+    days_since_saturday = (today.weekday() - 5) % 7
+    if days_since_saturday == 6:
+        return today + timedelta(days=1)
+    return today - timedelta(days=days_since_saturday)
+
+# /week: the whole week from one timetable lookup and one tests query, cached until the week is over
+async def week_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
 
-    if not classes:
-        response = f"❌ *No classes scheduled for Monday ({monday_date})* ❌"
-    else:
-        response = f" *Monday's Schedule ({monday_date})*: \n\n"
-        response += format_schedule(classes)
+    vacation_active, vacation_message = is_vacation(chat_id)
+    if vacation_active:
+        await update.message.reply_text(vacation_message, parse_mode="Markdown")
+        return
 
-    await update.message.reply_text(response, parse_mode="Markdown")
+    first = week_start(clock.today())
+    days = [first + timedelta(days=offset) for offset in range(7)]
 
+    async def render() -> tuple:
+        rendered = await render_days(chat_id, "date", days)
+        header = f"🗓️ *Week of {first.strftime('%d-%m-%Y')} to {days[-1].strftime('%d-%m-%Y')}*"
+        return tuple(split_message("\n\n".join([header, *rendered])))
 
-# Function to get Tuesday's schedule
-async def tuesdays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    tuesday_day = "TUE"
-    tuesday_date = (datetime.now() + timedelta((1 - datetime.now().weekday()) % 7)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(tuesday_day)
+    # Friday is the last day this week is shown
+    messages = await cached_response(chat_id, ("week", first.isoformat()), render, expires=days[-1])
+    for message in messages:
+        await update.message.reply_text(message, parse_mode="Markdown")
 
-    if not classes:
-        response = f"❌ *No classes scheduled for Tuesday ({tuesday_date})* ❌"
-    else:
-        response = f" *Tuesday's Schedule ({tuesday_date})*: \n\n"
-        response += format_schedule(classes)
+#------------------------------------------
+# Replace 'GROUP_CHAT_ID' with the ID of your group chat
+# GROUP_CHAT_ID = '1130904432'
 
-    await update.message.reply_text(response, parse_mode="Markdown")
+async def send_scheduled_message():
+    tomorrow = clock.tomorrow()
+    tomorrow_day = DAYS[tomorrow.weekday()]
+    tomorrow_date = tomorrow.strftime("%d-%m-%Y")
 
-# Function to get Wednesday's schedule
-async def wednesdays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    wednesday_day = "WED"
-    wednesday_date = (datetime.now() + timedelta((2 - datetime.now().weekday()) % 7)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(wednesday_day)
+    async def render_digest(chat_id: int) -> str:
+        async def render() -> str:
+            classes = await get_classes_for_day(chat_id, tomorrow_day)
 
-    if not classes:
-        response = f"❌ *No classes scheduled for Wednesday ({wednesday_date})* ❌"
-    else:
-        response = f" *Wednesday's Schedule ({wednesday_date})*: \n\n"
-        response += format_schedule(classes)
+            if not classes:
+                return f"❌ *No classes scheduled for tomorrow ({tomorrow_date})* ❌"
+            return f" *Tomorrow's Schedule ({tomorrow_date})*: \n\n" + format_schedule(classes)
 
-    await update.message.reply_text(response, parse_mode="Markdown")
+        return await cached_response(chat_id, ("digest", tomorrow_day, tomorrow_date), render)
 
-# Function to get Thursday's schedule
-async def thursdays_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    thursday_day = "THU"
-    thursday_date = (datetime.now() + timedelta((3 - datetime.now().weekday()) % 7)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(thursday_day)
+    # Send every subscribed chat its own timetable and record how each delivery went
+    rows = await connect_db().fetchall("SELECT chat_id FROM Subscriptions WHERE active = 1")
+    messages = {chat_id: await render_digest(chat_id) for (chat_id,) in rows}
+    results = await broadcaster.broadcast(application.bot, messages, parse_mode="Markdown")
+    await connect_db().executemany(
+        """
+        UPDATE Subscriptions
+        SET last_status = ?, last_error = ?, last_attempt_at = CURRENT_TIMESTAMP,
+            active = CASE WHEN ? = 'blocked' THEN 0 ELSE active END
+        WHERE chat_id = ?
+        """,
+        [(status, error, status, chat_id) for chat_id, (status, error) in results.items()],
+    )
+    logger.info("Scheduled message sent to %d chats.", len(results))
 
-    if not classes:
-        response = f"❌ *No classes scheduled for Thursday ({thursday_date})* ❌"
-    else:
-        response = f" *Thursday's Schedule ({thursday_date})*: \n\n"
-        response += format_schedule(classes)
 
-    await update.message.reply_text(response, parse_mode="Markdown")
-    
-#------------------------------------------
-# Replace 'GROUP_CHAT_ID' with the ID of your group chat
-# GROUP_CHAT_ID = '1130904432'
-
-async def send_scheduled_message(application, group_chat_id):
-    tomorrow_day = (datetime.now() + timedelta(days=1)).strftime("%a").upper()
-    tomorrow_date = (datetime.now() + timedelta(days=1)).strftime("%d-%m-%Y")
-    classes = get_classes_for_day(tomorrow_day)
+# Subscribe the current chat to the daily digest
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await connect_db().execute(
+        "INSERT INTO Subscriptions (chat_id) VALUES (?) ON CONFLICT (chat_id) DO UPDATE SET active = 1",
+        (update.effective_chat.id,),
+    )
+    await update.message.reply_text("✅ This chat will get tomorrow's schedule every day.")
 
-    if not classes:
-        response = f"❌ *No classes scheduled for tomorrow ({tomorrow_date})* ❌"
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    rows = await connect_db().execute("UPDATE Subscriptions SET active = 0 WHERE chat_id = ?", (update.effective_chat.id,))
+    if rows:
+        await update.message.reply_text("✅ This chat won't get the daily schedule anymore.")
     else:
-        response = f" *Tomorrow's Schedule ({tomorrow_date})*: \n\n"
-        response += format_schedule(classes)
-
-    # Send the message to the group chat
-    await application.bot.send_message(chat_id=group_chat_id, text=response, parse_mode="Markdown")
-    logger.info("Scheduled message sent to the group.")
+        await update.message.reply_text("❌ This chat isn't subscribed.")
     
     
     
@@ -516,20 +629,29 @@ async def add_schedule_class_name(update: Update, context: ContextTypes.DEFAULT_
 
 # Collect start time, then ask for end time
 async def add_schedule_start_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["start_time"] = update.message.text.strip()
+    try:
+        context.user_data["start_minute"] = parse_time(update.message.text)
+    except ValueError:
+        await update.message.reply_text("❌ Invalid time format. Use HH:MM (e.g., 10:00):")
+        return START_TIME
     await update.message.reply_text("Enter the end time (e.g., 11:00):")
     return END_TIME
 
 # Collect end time and save the new class to the database
 async def add_schedule_end_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["end_time"] = update.message.text.strip()
     try:
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO Classes (day, class_name, start_time, end_time) VALUES (?, ?, ?, ?)", 
-                       (context.user_data["day"], context.user_data["class_name"], context.user_data["start_time"], context.user_data["end_time"]))
-        conn.commit()
-        conn.close()
+        end_minute = parse_time(update.message.text)
+    except ValueError:
+        await update.message.reply_text("❌ Invalid time format. Use HH:MM (e.g., 11:00):")
+        return END_TIME
+    start_minute = context.user_data["start_minute"]
+    if end_minute <= start_minute:
+        await update.message.reply_text("❌ The end time must be after the start time. Enter the end time:")
+        return END_TIME
+    try:
+        chat_id = update.effective_chat.id
+        await insert_class(chat_id, context.user_data["day"], context.user_data["class_name"], start_minute, end_minute)
+        await refresh_classes_for_day(chat_id, context.user_data["day"])
         await update.message.reply_text("✅ Class added successfully!")
     except sqlite3.Error as e:
         logger.error("Database error: %s", e)
@@ -537,6 +659,14 @@ async def add_schedule_end_time(update: Update, context: ContextTypes.DEFAULT_TY
     return ConversationHandler.END
 
 #add class---------------------------------------------
+# Times are validated before this point and stored both as HH:MM and as minutes since midnight
+async def insert_class(chat_id: int, day: str, class_name: str, start_minute: int, end_minute: int) -> None:
+    await connect_db().execute(
+        "INSERT INTO Classes (chat_id, day, class_name, start_time, end_time, start_minute, end_minute) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (chat_id, day, class_name, format_time(start_minute), format_time(end_minute), start_minute, end_minute),
+    )
+
 async def add_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Add a new class to the schedule by providing all details in one command.
@@ -568,25 +698,22 @@ async def add_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             )
             return
 
-        # Validate time format (optional, you can remove if unnecessary)
-        import re
-        time_format = r"^\d{2}:\d{2}$"
-        if not re.match(time_format, start_time) or not re.match(time_format, end_time):
+        # Validate time format
+        try:
+            start_minute, end_minute = parse_time(start_time), parse_time(end_time)
+        except ValueError:
             await update.message.reply_text(
                 "❌ Invalid time format. Use HH:MM (e.g., 10:00).",
                 parse_mode="Markdown",
             )
             return
+        if end_minute <= start_minute:
+            await update.message.reply_text("❌ The end time must be after the start time.")
+            return
 
         # Save to the database
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO Classes (day, class_name, start_time, end_time) VALUES (?, ?, ?, ?)",
-            (day, class_name, start_time, end_time),
-        )
-        conn.commit()
-        conn.close()
+        await insert_class(update.effective_chat.id, day, class_name, start_minute, end_minute)
+        await refresh_classes_for_day(update.effective_chat.id, day)
 
         # Send success message
         await update.message.reply_text(
@@ -625,17 +752,15 @@ async def delete_schedule_day(update: Update, context: ContextTypes.DEFAULT_TYPE
 # Delete the specified class from the database
 async def delete_schedule_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     class_name = update.message.text.strip()
+    chat_id = update.effective_chat.id
     try:
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM Classes WHERE day = ? AND class_name = ?", 
-            (context.user_data["day"], class_name)
+        rows_deleted = await connect_db().execute(
+            "DELETE FROM Classes WHERE chat_id = ? AND day = ? AND class_name = ?", 
+            (chat_id, context.user_data["day"], class_name)
         )
-        conn.commit()
-        conn.close()
+        await refresh_classes_for_day(chat_id, context.user_data["day"])
         
-        if cursor.rowcount > 0:
+        if rows_deleted > 0:
             await update.message.reply_text("✅ Class deleted successfully!")
         else:
             await update.message.reply_text("❌ No matching class found to delete.")
@@ -679,14 +804,13 @@ async def delete_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             return
 
         # Delete the class from the database
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM Classes WHERE day = ? AND class_name = ?", (day, class_name))
-        conn.commit()
-        conn.close()
+        rows_deleted = await connect_db().execute(
+            "DELETE FROM Classes WHERE chat_id = ? AND day = ? AND class_name = ?", (update.effective_chat.id, day, class_name)
+        )
+        await refresh_classes_for_day(update.effective_chat.id, day)
 
         # Confirm success
-        if cursor.rowcount > 0:
+        if rows_deleted > 0:
             await update.message.reply_text(f"✅ Class `{class_name}` on `{day}` deleted successfully!", parse_mode="Markdown")
         else:
             await update.message.reply_text(f"❌ No class `{class_name}` found on `{day}` to delete.", parse_mode="Markdown")
@@ -699,6 +823,61 @@ async def delete_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text("❌ An unexpected error occurred. Please try again.")
 
 
+#import / export ----------------------
+# Largest timetable file /import downloads
+MAX_IMPORT_BYTES = 1024 * 1024
+
+async def import_timetable(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Load a CSV or JSON timetable sent with /import as its caption, or replied to with /import.
+    Columns: day, class_name, start_time, end_time (e.g. MON, Physics, 10:00, 11:00).
+    /import replace drops the chat's classes first, otherwise the rows are added.
+    """
+    message = update.message
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if document is None:
+        await message.reply_text(
+            "❌ Send a .csv or .json file with `/import` as its caption (or reply to one with `/import`).\n"
+            "Columns: `day, class_name, start_time, end_time`, e.g. `MON, Physics, 10:00, 11:00`.\n"
+            "Use `/import replace` to replace this chat's classes instead of adding to them.",
+            parse_mode="Markdown",
+        )
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+        await message.reply_text("❌ The file is too large to import.")
+        return
+    replace = "replace" in (message.text or message.caption or "").lower().split()[1:]
+
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    try:
+        rows = parse_timetable(data, document.file_name or "")
+    except ValueError as e:
+        await message.reply_text(f"❌ Nothing was imported:\n{e}")
+        return
+
+    chat_id = update.effective_chat.id
+    try:
+        # All rows in one transaction with a single commit
+        imported = await connect_db().run(import_classes, chat_id, rows, replace)
+    except sqlite3.Error as e:
+        logger.error("Database error: %s", e)
+        await message.reply_text("❌ Error importing the timetable. Please try again.")
+        return
+    await refresh_timetable(chat_id)
+    await message.reply_text(f"✅ Imported {imported} classes{' (replaced the old timetable)' if replace else ''}.")
+
+async def export_timetable(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /export (CSV) or /export json, in the format /import reads back
+    timetable = await get_timetable(update.effective_chat.id)
+    if context.args and context.args[0].lower() == "json":
+        data, filename = export_json(timetable), "timetable.json"
+    else:
+        data, filename = export_csv(timetable), "timetable.csv"
+    await update.message.reply_document(document=data, filename=filename, caption="Here is this chat's timetable.")
+
+
+
 #delete all class ----------------------
 async def delete_all_classes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if len(context.args) != 1:
@@ -708,13 +887,11 @@ async def delete_all_classes(update: Update, context: ContextTypes.DEFAULT_TYPE)
     day = context.args[0].strip().upper()
     
     try:
-        conn = sqlite3.connect("schedule.db")
-        cursor = conn.cursor()
         # Delete all classes for the specified day
-        cursor.execute("DELETE FROM Classes WHERE day = ?", (day,))
-        conn.commit()
-        rows_deleted = cursor.rowcount
-        conn.close()
+        rows_deleted = await connect_db().execute(
+            "DELETE FROM Classes WHERE chat_id = ? AND day = ?", (update.effective_chat.id, day)
+        )
+        await refresh_classes_for_day(update.effective_chat.id, day)
 
         if rows_deleted > 0:
             await update.message.reply_text(f"✅ All classes for {day} have been deleted!")
@@ -736,10 +913,56 @@ async def delete_all_classes(update: Update, context: ContextTypes.DEFAULT_TYPE)
 #     except Exception as e:
 #         logger.error("Error in /time command: %s", e)
 
+# Timetable and rendered message cache hit/miss counters
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    stats = timetable_cache.stats()
+    rendered = response_cache.stats()
+    await update.message.reply_text(
+        f"📊 Timetable cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_ratio']:.1%} hit ratio), {stats['days']} days of {stats['tenants']} chats cached\n"
+        f"📊 Rendered messages: {rendered['hits']} hits, {rendered['misses']} misses "
+        f"({rendered['hit_ratio']:.1%} hit ratio), {rendered['entries']} entries"
+    )
+
+
+# The same counters for /metrics, with the uploaded file_ids as a third cache
+def cache_lookups() -> dict:
+    stats, rendered = timetable_cache.stats(), response_cache.stats()
+    return {
+        ("timetable", "hit"): stats["hits"],
+        ("timetable", "miss"): stats["misses"],
+        ("rendered", "hit"): rendered["hits"],
+        ("rendered", "miss"): rendered["misses"],
+        ("asset", "hit"): asset_registry.reuses,
+        ("asset", "miss"): asset_registry.uploads,
+    }
+
+
+def cache_hit_ratios() -> dict:
+    lookups = cache_lookups()
+    ratios = {}
+    for cache in ("timetable", "rendered", "asset"):
+        total = lookups[(cache, "hit")] + lookups[(cache, "miss")]
+        ratios[(cache,)] = lookups[(cache, "hit")] / total if total else 0.0
+    return ratios
+
+
+CollectedMetric("bot_cache_lookups_total", "Cache lookups, by cache and result.", "counter", ["cache", "result"], cache_lookups)
+CollectedMetric("bot_cache_hit_ratio", "Hit ratio of each cache since startup.", "gauge", ["cache"], cache_hit_ratios)
+
+# Show which indexes the hot queries use
+async def db_plan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    db = connect_db()
+    version = await db.run(schema_version)
+    plans = await db.run(explain_hot_queries)
+    response = f"🗄️ Schema version: {version}\n\n"
+    for name, details in plans.items():
+        response += f"{name}:\n" + "\n".join(f"  {detail}" for detail in details) + "\n\n"
+    await update.message.reply_text(response)
+
 #function to get current time
 async def current_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    tz = pytz.timezone("Asia/Dhaka")
-    now = datetime.now(tz)
+    now = clock.now()
     time_str = now.strftime("%I:%M %p, %A, %d-%m-%Y")
     await update.message.reply_text(f"🕰️ *Current Time:* {time_str}", parse_mode="Markdown")
     
@@ -761,37 +984,36 @@ async def clear_bot_messages(update: Update, context: ContextTypes.DEFAULT_TYPE)
             try:
                 await bot.delete_message(chat_id, message.message_id)
             except Exception as e:
-                print(f"Could not delete message {message.message_id}: {e}")
+                logger.warning("Could not delete message %s: %s", message.message_id, e)
     
     # Finally, delete the confirmation message
     try:
         await confirmation_msg.delete()
     except Exception as e:
-        print(f"Could not delete confirmation message: {e}")
+        logger.warning("Could not delete confirmation message: %s", e)
         
     #------------------------------------------------ Class tests --------------------------------------
     
 
-# Connect to the SQLite database
-def connect_db():
-    return sqlite3.connect("schedule.db")
+# Delete the tests before today in one transaction, returns the chats that had any
+def delete_old_tests(conn, today: str) -> list:
+    chat_ids = [chat_id for (chat_id,) in conn.execute(queries.CHATS_WITH_OLD_TESTS, (today,))]
+    conn.execute(queries.DELETE_OLD_TESTS, (today,))
+    return chat_ids
 
 # Cleanup old tests function
-def cleanup_old_tests():
-    conn = connect_db()
-    cursor = conn.cursor()
-    
+# Runs from the scheduler just after midnight GMT+6 (and once at startup), never from a command.
+# Read handlers filter by date, so expired rows that are still here are simply not shown.
+async def cleanup_old_tests():
     # Get today's date in GMT+6
-    today = datetime.now(tz).strftime("%Y-%m-%d")
-    
-    # Delete tests that are before today
-    cursor.execute("DELETE FROM ClassTests WHERE test_date < ?", (today,))
+    today = clock.today().isoformat()
     
-    # Commit the changes
-    conn.commit()
-    conn.close()
+    # Delete tests that are before today, in every chat
+    chat_ids = await connect_db().run(delete_old_tests, today)
+    for chat_id in chat_ids:
+        response_cache.bump(chat_id, "tests")
     
-    print(f"Deleted tests older than {today} (GMT+6)")  # Debugging statement
+    logger.info("Deleted tests older than %s (GMT+6) in %d chats", today, len(chat_ids))
 
 
 # Command to add a class test
@@ -803,65 +1025,206 @@ async def add_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     test_date, subject, details = context.args[0], context.args[1], ' '.join(context.args[2:])
-    conn = connect_db()
-    cursor = conn.cursor()
+    # /ct parses the stored date and pages by it, so only a real YYYY-MM-DD date is accepted
+    try:
+        test_date = datetime.strptime(test_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        await update.message.reply_text("Invalid date format. Use YYYY-MM-DD.")
+        return
+    await connect_db().execute("INSERT INTO ClassTests (chat_id, test_date, subject, details) VALUES (?, ?, ?, ?)",
+                               (update.effective_chat.id, test_date, subject, details))
+    response_cache.bump(update.effective_chat.id, "tests")
 
-    cursor.execute("INSERT INTO ClassTests (test_date, subject, details) VALUES (?, ?, ?)",
-                   (test_date, subject, details))
-    conn.commit()
-    conn.close()
+    await update.message.reply_text(f"Test added on {test_date} for {subject}.")
 
-    cleanup_old_tests()  # Clean up old tests after adding a new one
+# The /ct message for (id, test_date, subject, details) rows, counting the days left from today.
+# The #id is what /del_ct takes.
+def format_tests(tests, today: date, title: str = "Upcoming Class Tests") -> str:
+    response = f"(╯‵□′)╯︵┻━┻  \n{title}: \n\n"
+
+    for test_id, test_date, subject, details in tests:
+        test_date_obj = datetime.strptime(test_date, "%Y-%m-%d").date()
+        days_remaining = (test_date_obj - today).days
+        day_name = test_date_obj.strftime("%A")  # Get the day name (e.g., "Tuesday")
+        response += (
+            f"📝 #{test_id} | {test_date_obj.strftime('%d-%m-%Y')} | {day_name}\n"
+            f"{subject}: {details} | ⌛{days_remaining} days remaining\n\n"
+        )
+    return response
 
-    await update.message.reply_text(f"Test added on {test_date} for {subject}.")
+# Tests shown per /ct page
+CT_PAGE_SIZE = 10
+
+# One page of a chat's upcoming tests in (test_date, id) order, read from idx_classtests_chat_date.
+# The page starts after the test whose id is cursor (forward) or ends before it (backward), its
+# (test_date, id) row key is looked up here; a cursor test deleted since starts over at the first page.
+# Returns (rows, has_prev, has_next); expired tests are left for the nightly cleanup.
+def tests_page(conn, chat_id: int, today: str, cursor=None, forward: bool = True, limit: int = CT_PAGE_SIZE):
+    after, before = queries.TESTS_PAGE_AFTER, queries.TESTS_PAGE_BEFORE
+
+    def key(test_date, test_id):
+        return (chat_id, today, max(today, test_date), test_date, test_id)
+
+    if cursor is not None:
+        cursor = conn.execute("SELECT test_date, id FROM ClassTests WHERE chat_id = ? AND id = ?", (chat_id, cursor)).fetchone()
+    if cursor is None:
+        cursor, forward = (today, 0), True
+    if not forward:
+        rows = conn.execute(before, key(*cursor) + (limit + 1,)).fetchall()
+        if rows:
+            has_prev, rows = len(rows) > limit, rows[:limit][::-1]
+            has_next = conn.execute(after, key(rows[-1][1], rows[-1][0]) + (1,)).fetchone() is not None
+            return rows, has_prev, has_next
+        # Everything before the cursor is gone (deleted or expired), show the first page
+        cursor = (today, 0)
+    rows = conn.execute(after, key(*cursor) + (limit + 1,)).fetchall()
+    has_next, rows = len(rows) > limit, rows[:limit]
+    has_prev = bool(rows) and conn.execute(before, key(rows[0][1], rows[0][0]) + (1,)).fetchone() is not None
+    return rows, has_prev, has_next
+
+# Drop tests from the far end of a page until it fits in one message, the next page starts with them.
+# A test too long for a message on its own is shown with its details, then its subject, shortened.
+def fit_tests_page(rows, today: date, forward: bool, has_prev: bool, has_next: bool) -> tuple:
+    rows = list(rows)
+    text = format_tests(rows, today)
+    while len(rows) > 1 and len(text) > MessageLimit.MAX_TEXT_LENGTH:
+        if forward:
+            rows.pop()
+            has_next = True
+        else:
+            rows.pop(0)
+            has_prev = True
+        text = format_tests(rows, today)
+    for field in (3, 2):  # details, then subject
+        overflow = len(text) - MessageLimit.MAX_TEXT_LENGTH
+        if overflow <= 0:
+            break
+        row = list(rows[0])
+        row[field] = row[field][:max(0, len(row[field]) - overflow - 1)] + "…"
+        rows = [tuple(row)]
+        text = format_tests(rows, today)
+    return text, rows, has_prev, has_next
+
+# The /ct message and its ◀️/▶️ buttons, which carry the id of the page's first and last test
+# (callback data is limited to 64 bytes, an id always fits)
+async def render_tests_page(chat_id: int, cursor=None, forward: bool = True):
+    today = clock.today()  # GMT+6
+    rows, has_prev, has_next = await connect_db().run(tests_page, chat_id, today.isoformat(), cursor, forward)
+    if not rows:
+        return "Chill bro! No Upcoming Class tests found.", None
+    text, rows, has_prev, has_next = fit_tests_page(rows, today, forward, has_prev, has_next)
+
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("◀️ Previous", callback_data=f"ct:prev:{rows[0][0]}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"ct:next:{rows[-1][0]}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+# "/ct next 7d": the days ahead to list, None if the arguments aren't a "next" filter
+def parse_next_days(args):
+    if not args or args[0].lower() != "next":
+        return None
+    if len(args) == 1:
+        return 7
+    value = args[1].lower().removesuffix("d")
+    if len(args) == 2 and value.isdigit() and 0 < int(value) <= 366:
+        return int(value)
+    return None
+
+# Upcoming tests of one subject (any case), from idx_classtests_chat_subject_date
+async def render_subject_tests(chat_id: int, subject: str) -> tuple:
+    today = clock.today()
+    rows = await connect_db().fetchall(queries.TESTS_FOR_SUBJECT, (chat_id, subject, today.isoformat()))
+    if not rows:
+        return (f"No upcoming class tests for {subject}.",)
+    return tuple(split_message(format_tests(rows, today, f"Upcoming {rows[0][2]} Tests")))
+
+# Tests from today through the next days days, from idx_classtests_chat_date
+async def render_next_tests(chat_id: int, days: int) -> tuple:
+    today = clock.today()
+    rows = await connect_db().fetchall(
+        queries.NEXT_TESTS, (chat_id, today.isoformat(), (today + timedelta(days=days)).isoformat())
+    )
+    if not rows:
+        return (f"Chill bro! No class tests in the next {days} days.",)
+    return tuple(split_message(format_tests(rows, today, f"Class Tests in the Next {days} Days")))
 
-# Command to list all class tests regardless of date
+# Command to list the upcoming class tests: a page at a time, of one subject (/ct Physics)
+# or of the next days (/ct next 7d). Filtered lists are cached until the tests change or midnight.
 async def list_tests(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = connect_db()
-    cursor = conn.cursor()
+    chat_id = update.effective_chat.id
+    if not context.args:
+        text, keyboard = await render_tests_page(chat_id)
+        await update.message.reply_text(text, reply_markup=keyboard)
+        return
 
-    # Select all tests from the ClassTests table
-    cursor.execute("SELECT id, test_date, subject, details FROM ClassTests ORDER BY test_date ASC")
-    tests = cursor.fetchall()
-    conn.close()
+    days = parse_next_days(context.args)
+    if days is not None:
+        messages = await cached_response(chat_id, ("ct", "next", days), lambda: render_next_tests(chat_id, days))
+    elif context.args[0].lower() == "next":
+        await update.message.reply_text("Usage: /ct next 7d (up to 366 days)")
+        return
+    else:
+        subject = " ".join(context.args)
+        messages = await cached_response(
+            chat_id, ("ct", "subject", subject.casefold()), lambda: render_subject_tests(chat_id, subject)
+        )
+    for message in messages:
+        await update.message.reply_text(message)
 
-    cleanup_old_tests()  # Clean up old tests after listing
+# ◀️/▶️ under a /ct page: replace the message with the page before or after it
+async def list_tests_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    try:
+        # Buttons sent before the cursor was only an id carry ct:<direction>:<date>:<id>
+        _, direction, *_, test_id = query.data.split(":")
+        cursor = int(test_id)
+    except ValueError:
+        await query.answer()
+        return
+    text, keyboard = await render_tests_page(update.effective_chat.id, cursor, forward=direction == "next")
+    await query.answer()
+    try:
+        await query.edit_message_text(text, reply_markup=keyboard)
+    except BadRequest as e:
+        # An old button that leads to the page already shown
+        if "not modified" not in str(e).lower():
+            raise
 
-    if not tests:
-        await update.message.reply_text("Chill bro! No Upcoming Class tests found.")
-    else:
-        response = "(╯‵□′)╯︵┻━┻  \nUpcoming Class Tests: \n\n"
-        tz = pytz.timezone("Asia/Dhaka")  # Use GMT+6 time zone
-        today = datetime.now(tz).date()
-
-        for test_id, test_date, subject, details in tests:
-            test_date_obj = datetime.strptime(test_date, "%Y-%m-%d").date()
-            days_remaining = (test_date_obj - today).days
-            day_name = test_date_obj.strftime("%A")  # Get the day name (e.g., "Tuesday")
-            response += (
-                f"📝 {test_date_obj.strftime('%d-%m-%Y')} | {day_name}\n"
-                f"{subject}: {details} | ⌛{days_remaining} days remaining\n\n"
-            )
-        
-        await update.message.reply_text(response)
 
+# Delete one of the chat's tests, returns its (test_date, subject) or None if the chat has no such test
+def delete_test_by_id(conn, chat_id: int, test_id: int):
+    row = conn.execute("SELECT test_date, subject FROM ClassTests WHERE chat_id = ? AND id = ?", (chat_id, test_id)).fetchone()
+    if row is not None:
+        conn.execute("DELETE FROM ClassTests WHERE id = ?", (test_id,))
+    return row
 
-# Command to delete a test by date
+# Command to delete a test by its #id from /ct, or every test on a date
 async def delete_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) != 1:
-        await update.message.reply_text("Usage: /delete_test YYYY-MM-DD")
+        await update.message.reply_text("Usage: /del_ct ID (the #number in /ct) or /del_ct YYYY-MM-DD")
+        return
+
+    chat_id = update.effective_chat.id
+    if context.args[0].lstrip("#").isdigit():
+        test_id = int(context.args[0].lstrip("#"))
+        deleted = await connect_db().run(delete_test_by_id, chat_id, test_id)
+        if deleted is None:
+            await update.message.reply_text(f"No class test #{test_id} in this chat.")
+            return
+        response_cache.bump(chat_id, "tests")
+        test_date, subject = deleted
+        await update.message.reply_text(f"Deleted test #{test_id}: {subject} on {test_date}.")
         return
 
     test_date = context.args[0]
-    conn = connect_db()
-    cursor = conn.cursor()
 
     # Delete all tests scheduled for the specified date
-    cursor.execute("DELETE FROM ClassTests WHERE test_date = ?", (test_date,))
-    conn.commit()
-    conn.close()
-
-    cleanup_old_tests()  # Clean up old tests after deletion
+    await connect_db().execute(
+        "DELETE FROM ClassTests WHERE chat_id = ? AND test_date = ?", (update.effective_chat.id, test_date)
+    )
+    response_cache.bump(update.effective_chat.id, "tests")
 
     await update.message.reply_text(f"All tests scheduled for {test_date} have been deleted.")
 
@@ -869,17 +1232,59 @@ async def delete_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #------------------------------------end of class tests--------------------------------------------------------
 
 
-async def send_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    # Specify the path to the schedule.png
-    file_path = "schedule.png"
+# Files are uploaded once, later requests re-send the Telegram file_id
+asset_registry = AssetRegistry()
+
+# Timetable images by chat: (schedule version, PNG bytes), redrawn only after the chat's classes change
+timetable_images = {}
+
+# Drawing takes a noticeable amount of CPU, it runs in a worker process so the event loop keeps going
+render_pool = None
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global render_pool
+    if render_pool is None:
+        # spawn: forking a process that runs database and HTTP threads isn't safe
+        render_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return render_pool
 
-    if not os.path.exists(file_path):
-        await update.message.reply_text(f"Sorry, I couldn't find the file '{file_path}'!")
+async def get_timetable_image(chat_id: int):
+    # None when the chat has no classes to draw
+    version = response_cache.version(chat_id, "schedule")
+    cached = timetable_images.get(chat_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    timetable = await get_timetable(chat_id)
+    if not any(timetable.values()):
+        return None
+    colours = course_colours({class_name for classes in timetable.values() for class_name, _, _ in classes}, course_emojis)
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(get_render_pool(), render_timetable, timetable, colours, "Class Schedule")
+    timetable_images[chat_id] = (version, png)
+    return png
+
+async def send_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Without Pillow, fall back to the hand-made schedule.png
+    if Image is None:
+        file_path = "schedule.png"
+        if not os.path.exists(file_path):
+            await update.message.reply_text(f"Sorry, I couldn't find the file '{file_path}'!")
+            return
+        await asset_registry.send(file_path, "photo", lambda photo: update.message.reply_photo(photo=photo))
+        await update.message.reply_text("Here is the schedule!")
         return
 
     try:
-        # Send the image as a reply
-        await update.message.reply_photo(photo=open(file_path, 'rb'))
+        png = await get_timetable_image(update.effective_chat.id)
+        if png is None:
+            await update.message.reply_text("❌ No classes to draw yet, add some with /add_class.")
+            return
+        # Send the image as a reply, an unchanged image goes by its file_id
+        await asset_registry.send_bytes(
+            png, "schedule.png", "photo", lambda photo: update.message.reply_photo(photo=photo),
+            path=f"timetables/{update.effective_chat.id}.png",
+        )
         await update.message.reply_text("Here is the schedule!")
     except Exception as e:
         await update.message.reply_text(f"An error occurred: {e}")
@@ -891,10 +1296,51 @@ async def send_syllabus(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check if the file exists
     if os.path.exists(file_path):
         # Send the file
-        await update.message.reply_document(document=open(file_path, 'rb'), caption="Here is the syllabus.")
+        await asset_registry.send(
+            file_path, "document",
+            lambda document: update.message.reply_document(document=document, caption="Here is the syllabus."),
+        )
     else:
         await update.message.reply_text("Sorry, I couldn't find the file.")
 
+# Calendar feeds, one .ics file per chat
+CALENDAR_DIR = os.environ.get("CALENDAR_DIR", "calendars")
+
+# chat_id -> version stamp the chat's file was built for, it's rebuilt only after the classes, tests or vacation change
+calendar_versions = {}
+
+async def calendar_file(chat_id: int) -> str:
+    path = os.path.join(CALENDAR_DIR, str(chat_id), "schedule.ics")
+    # Take the stamp before reading so a concurrent change makes the next request rebuild
+    stamp = response_cache.stamp(chat_id)
+    if calendar_versions.get(chat_id) == stamp and os.path.exists(path):
+        return path
+
+    db = connect_db()
+    classes = await db.fetchall(
+        "SELECT id, day, class_name, start_minute, end_minute FROM Classes WHERE chat_id = ? ORDER BY day, start_minute",
+        (chat_id,),
+    )
+    tests = await db.fetchall(
+        "SELECT id, test_date, subject, details FROM ClassTests WHERE chat_id = ? ORDER BY test_date", (chat_id,)
+    )
+    data = build_calendar(chat_id, tz, week_start(clock.today()), classes, tests, vacation_state(chat_id))
+    await asyncio.to_thread(write_atomic, path, data)
+    calendar_versions[chat_id] = stamp
+    logger.info("Calendar of chat %s rebuilt: %d classes, %d tests", chat_id, len(classes), len(tests))
+    return path
+
+# Send the chat's schedule as an .ics file to import into a phone's calendar
+async def send_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    path = await calendar_file(update.effective_chat.id)
+    # Unchanged content is re-sent by file_id, see AssetRegistry
+    await asset_registry.send(
+        path, "document",
+        lambda document: update.message.reply_document(
+            document=document, caption="📅 Open this file to add the class schedule to your calendar."
+        ),
+    )
+
      
 #Fun functions -----------------------------------------------------------------------
 # List of "techy" messages to display
@@ -967,7 +1413,10 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                "/mon - Get Monday's class schedule\n" \
                "/tue - Get Tuesday's class schedule\n" \
                "/wed - Get Wednesday's class schedule\n" \
-               "/thu - Get Thursday's class schedule\n"
+               "/thu - Get Thursday's class schedule\n" \
+               "/date DD-MM-YYYY - Get the class schedule of any date\n" \
+               "/week - Get the whole week's class schedule\n" \
+               "/calendar - Get the schedule as a calendar file (.ics)\n"
     
     await update.message.reply_text(response, parse_mode="Markdown")
 
@@ -978,32 +1427,87 @@ async def config(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                "/delete\\_schedule - Step by step process to delete a class\n" \
                "/del\\_class - Shortcut for deleting a class\n" \
                "/del\\_all - delete all classes of a specific day\n" \
+               "/import - Load classes from a CSV/JSON file sent with /import as caption\n" \
+               "/export - Download this chat's classes as CSV (/export json for JSON)\n" \
                "/add\\_ct - add a ct \n" \
-               "/del\\_ct - delete a ct by date\n" \
-               "/ct - to get all ct list\n" \
+               "/del\\_ct - delete a ct by its #id (or every ct on a date)\n" \
+               "/ct - to get all ct list (/ct SUBJECT or /ct next 7d to filter)\n" \
                "/set\\_vac - Set vacation date to turn on vacation mode\n" \
+               "/subscribe - Get tomorrow's schedule in this chat every day\n" \
+               "/unsubscribe - Stop the daily schedule in this chat\n" \
+               "/cache\\_stats - Cache hit/miss counters\n" \
+               "/db\\_plan - Schema version and query plans of the hot queries\n" \
     
     await update.message.reply_text(response, parse_mode="Markdown")
 
 
 
 
+# Listening /metrics server, None when METRICS_PORT is 0
+metrics_server = None
+
+
+# Warm the caches and drop tests that expired while the bot was down
+async def on_startup(application) -> None:
+    global metrics_server
+    if METRICS_PORT:
+        metrics_server = await serve_metrics(METRICS_HOST, METRICS_PORT)
+    await load_timetable()
+    await load_vacation()
+    await asset_registry.load()
+    await connect_db().execute("INSERT OR IGNORE INTO Subscriptions (chat_id) VALUES (?)", (DIGEST_CHAT_ID,))
+    await cleanup_old_tests()
+    await start_reminders()
+
+# Stop the reminder timer and close the pooled database connections when the bot stops
+async def on_shutdown(application) -> None:
+    await reminder_wheel.stop()
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    if render_pool is not None:
+        render_pool.shutdown(cancel_futures=True)
+    # Stops the scheduler and waits for the job store's queued writes
+    scheduler.shutdown(wait=False)
+    connect_db().close()
+
+
+# Add a stored job unless it's already there, so its next (or missed) run survives the restart
+def ensure_job(job_id: str, func, trigger) -> None:
+    job = scheduler.get_job(job_id)
+    # repr, unlike str, includes the trigger's timezone
+    if job is None or job.func is not func or repr(job.trigger) != repr(trigger):
+        scheduler.add_job(func, trigger, id=job_id, replace_existing=True)
+
+
 # Main function to start the bot
 def main():
-    application = ApplicationBuilder().token('7916791560:AAFUraNz5l2JWo9ipS_yh2LLwUuQlahMHFk').build()
+    global application
+
+    if not BOT_TOKEN:
+        raise SystemExit("BOT_TOKEN is not set, export the token @BotFather gave the bot")
+
+    # Bring schedule.db up to the current schema before handling any update
+    connect_db().call(migrate)
+
+    builder = ApplicationBuilder().token(BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown)
+    # Same pool sizes as the builder's defaults, timed for /metrics
+    builder = builder.request(InstrumentedRequest(connection_pool_size=256))
+    builder = builder.get_updates_request(InstrumentedRequest(connection_pool_size=1))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL)
+    if TELEGRAM_FILE_URL:
+        builder = builder.base_file_url(TELEGRAM_FILE_URL)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
 
     # Add the handlers for each command
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help))
     application.add_handler(CommandHandler("config", config))
-    application.add_handler(CommandHandler("today", todays_schedule))
-    application.add_handler(CommandHandler("tomorrow", tomorrows_schedule))
-    application.add_handler(CommandHandler("sat", saturdays_schedule))
-    application.add_handler(CommandHandler("sun", sundays_schedule))
-    application.add_handler(CommandHandler("mon", mondays_schedule))
-    application.add_handler(CommandHandler("tue", tuesdays_schedule))
-    application.add_handler(CommandHandler("wed", wednesdays_schedule))
-    application.add_handler(CommandHandler("thu", thursdays_schedule))
+    application.add_handler(CommandHandler([*RELATIVE_DAY_COMMANDS, *WEEKDAY_COMMANDS, "date"], schedule_command))
+    application.add_handler(CommandHandler("week", week_schedule))
     application.add_handler(CommandHandler("custom", custom_message))
     
     # Register the clear command
@@ -1011,17 +1515,24 @@ def main():
     
     # Add this command handler in the main function
     application.add_handler(CommandHandler("time", current_time))
+    application.add_handler(CommandHandler("cache_stats", cache_stats))
+    application.add_handler(CommandHandler("subscribe", subscribe))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe))
+    application.add_handler(CommandHandler("db_plan", db_plan))
     
 
     # Set up the scheduler (APScheduler) to send the message every day at 8 AM
-    scheduler = AsyncIOScheduler()
-    group_chat_id = '-1002295712106'  # Replace with your group chat ID
-    scheduler.add_job(lambda: send_scheduled_message(application, group_chat_id), 'cron', hour=13, minute=20)
-
     # Log scheduler start
     logger.info("Starting scheduler...")
-    # Start the scheduler
-    scheduler.start()
+    # Start the scheduler paused: the stored jobs are loaded, then the ones below are added if missing
+    scheduler.start(paused=True)
+    # Stored by versions before every chat had its own vacation, end_vacation takes the chat now
+    if scheduler.get_job("vacation_end"):
+        scheduler.remove_job("vacation_end")
+    ensure_job("daily_digest", send_scheduled_message, CronTrigger(hour=13, minute=20, timezone=tz))
+    ensure_job("evict_rendered_responses", evict_rendered_responses, CronTrigger(hour=0, minute=0, timezone=tz))
+    ensure_job("cleanup_old_tests", cleanup_old_tests, CronTrigger(hour=0, minute=1, timezone=tz))
+    scheduler.resume()
 
     # Conversation handler for adding schedules
     add_schedule_handler = ConversationHandler(
@@ -1066,6 +1577,9 @@ def main():
     application.add_handler(CommandHandler("add_class", add_class))
     application.add_handler(CommandHandler("del_class", delete_class))
     application.add_handler(CommandHandler("del_all", delete_all_classes))
+    application.add_handler(CommandHandler("import", import_timetable))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/import(@\w+)?\b"), import_timetable))
+    application.add_handler(CommandHandler("export", export_timetable))
     
     
     #vacation commands--------------------------------------------------
@@ -1077,16 +1591,32 @@ def main():
     
     application.add_handler(CommandHandler("add_ct", add_test))
     application.add_handler(CommandHandler("ct", list_tests))
+    application.add_handler(CallbackQueryHandler(list_tests_page, pattern=r"^ct:"))
     application.add_handler(CommandHandler("del_ct", delete_test))
     
     #Fun Functions -----------------------------------------------------
     application.add_handler(CommandHandler("hack", hack))
     application.add_handler(CommandHandler("schedule", send_schedule))
     application.add_handler(CommandHandler("syllabus", send_syllabus))
+    application.add_handler(CommandHandler("calendar", send_calendar))
+
+    # Record the latency and errors of every handler above
+    instrument_handlers(application)
 
     # Start the bot
-    logger.info("Starting bot...")
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        logger.info("Starting bot with a webhook on %s:%d/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        logger.info("Starting bot...")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
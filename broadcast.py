@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one per second in a chat
+GLOBAL_RATE = 25.0
+PER_CHAT_RATE = 1.0
+
+# Chat buckets kept before the full, idle ones are dropped
+MIN_CHAT_BUCKETS = 256
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average with bursts of up to capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def idle(self, now: float) -> bool:
+        # Refilled to capacity with nobody waiting, so it acts exactly like a new bucket
+        return (
+            not self._lock.locked()
+            and now >= self.paused_until
+            and self.tokens + (now - self.updated) * self.rate >= self.capacity
+        )
+
+    def pause(self, seconds: float) -> None:
+        # Telegram told us to back off (429), stop handing out tokens for a while
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self) -> None:
+        # The lock makes waiters take turns, so nobody starves under load
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class Broadcaster:
+    """
+    Sends a message to each of many chats concurrently within Telegram's flood limits.
+    Every chat gets a status: "sent", "blocked" (the bot was removed) or "failed".
+    The limits only hold if every sender shares one Broadcaster.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 concurrency: int = 20, max_attempts: int = 4):
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.chat_buckets = {}
+        self._prune_at = MIN_CHAT_BUCKETS
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self._prune_at:
+                self._prune()
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _prune(self) -> None:
+        # Every chat the bot ever messaged would keep a bucket otherwise. Pruning again only once
+        # the survivors have doubled keeps the cost per new chat constant.
+        now = time.monotonic()
+        self.chat_buckets = {chat_id: bucket for chat_id, bucket in self.chat_buckets.items() if not bucket.idle(now)}
+        self._prune_at = max(MIN_CHAT_BUCKETS, 2 * len(self.chat_buckets))
+
+    async def send(self, bot, chat_id, text: str, **kwargs) -> tuple[str, str]:
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            backoff = 0
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return "sent", None
+            except RetryAfter as e:
+                # A 429 applies to the whole bot, so pause every sender
+                self.global_bucket.pause(retry_after_seconds(e))
+                error = str(e)
+            except Forbidden as e:
+                return "blocked", str(e)
+            except BadRequest as e:
+                return "failed", str(e)
+            except NetworkError as e:
+                # Includes TimedOut, back off a little more on every attempt
+                error = str(e)
+                backoff = 0.5 * 2 ** attempt
+            # No retry follows the last attempt, so nothing to wait for or count
+            if attempt < self.max_attempts:
+                self.retries += 1
+                if backoff:
+                    await asyncio.sleep(backoff)
+        return "failed", error
+
+    async def broadcast(self, bot, messages: dict, **kwargs) -> dict:
+        # messages: chat_id -> text, returns chat_id -> (status, error)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        retries = self.retries
+
+        async def deliver(chat_id, text):
+            async with semaphore:
+                return chat_id, await self.send(bot, chat_id, text, **kwargs)
+
+        results = dict(await asyncio.gather(*(deliver(chat_id, text) for chat_id, text in messages.items())))
+        sent = sum(1 for status, _ in results.values() if status == "sent")
+        logger.info("Broadcast delivered to %d of %d chats (%d retries)", sent, len(results), self.retries - retries)
+        return results
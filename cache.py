@@ -0,0 +1,139 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+DAYS = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+
+
+class TimetableCache:
+    """
+    Process-wide (chat_id, weekday) -> sorted classes cache for the Classes table.
+    Built once at startup and patched by the handlers that change the table.
+    Every chat has its own timetable; once loaded, a chat without classes
+    is answered with an empty day instead of a miss.
+    """
+
+    def __init__(self):
+        self._tenants = {}  # chat_id -> {day: classes}
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def _tenant(self, chat_id) -> dict:
+        days = self._tenants.get(chat_id)
+        if days is None:
+            # A chat that is new since the load has no classes on the days not written yet
+            days = self._tenants[chat_id] = {day: () for day in DAYS} if self.loaded else {}
+        return days
+
+    def get(self, chat_id, day: str):
+        # Returns None when the day has not been loaded yet
+        days = self._tenants.get(chat_id)
+        if days is None:
+            classes = () if self.loaded else None
+        else:
+            classes = days.get(day)
+        if classes is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return classes
+
+    def put(self, chat_id, day: str, classes) -> None:
+        self._tenant(chat_id)[day] = tuple(classes)
+
+    def replace_all(self, rows) -> None:
+        # rows: (chat_id, day, class_name, start_time, end_time) already sorted by start time
+        tenants = {}
+        for chat_id, day, class_name, start_time, end_time in rows:
+            days = tenants.get(chat_id)
+            if days is None:
+                days = tenants[chat_id] = {day: [] for day in DAYS}
+            days.setdefault(day, []).append((class_name, start_time, end_time))
+        self._tenants = {
+            chat_id: {day: tuple(classes) for day, classes in days.items()} for chat_id, days in tenants.items()
+        }
+        self.loaded = True
+        logger.info("Timetable cache loaded: %d classes in %d chats", len(rows), len(tenants))
+
+    def invalidate(self, chat_id=None, day: str = None) -> None:
+        if chat_id is None:
+            self._tenants.clear()
+            self.loaded = False
+        elif day is None:
+            self._tenants[chat_id] = {}
+        else:
+            self._tenant(chat_id).pop(day, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "tenants": len(self._tenants),
+            "days": sum(len(days) for days in self._tenants.values()),
+        }
+
+
+class ResponseCache:
+    """
+    Rendered schedule messages of each chat keyed by (command, day, date, version stamp).
+    A chat's stamp changes whenever its classes, tests or vacation state change,
+    so a message rendered before a change can never be served after it.
+    Every entry also has the date it expires on, when the message no longer applies.
+    """
+
+    def __init__(self):
+        self._entries = {}   # chat_id -> {key: (response, expires)}
+        self._versions = {}  # chat_id -> {"schedule": n, "tests": n, "vacation": n}
+        self.hits = 0
+        self.misses = 0
+
+    def stamp(self, chat_id) -> tuple:
+        versions = self._versions.get(chat_id)
+        return tuple(versions.values()) if versions else (0, 0, 0)
+
+    def version(self, chat_id, name: str) -> int:
+        versions = self._versions.get(chat_id)
+        return versions[name] if versions else 0
+
+    def get(self, chat_id, key):
+        entry = self._entries.get(chat_id, {}).get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, chat_id, key, response, expires) -> None:
+        # Entries rendered against an older stamp are unreachable, don't store them
+        if key[-1] == self.stamp(chat_id):
+            self._entries.setdefault(chat_id, {})[key] = (response, expires)
+
+    def bump(self, chat_id, name: str) -> None:
+        versions = self._versions.setdefault(chat_id, {"schedule": 0, "tests": 0, "vacation": 0})
+        versions[name] += 1
+        self._entries.pop(chat_id, None)
+
+    def evict_expired(self, today) -> int:
+        evicted = 0
+        for chat_id, entries in list(self._entries.items()):
+            for key in [key for key, (_, expires) in entries.items() if expires <= today]:
+                del entries[key]
+                evicted += 1
+            if not entries:
+                del self._entries[chat_id]
+        return evicted
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "entries": sum(len(entries) for entries in self._entries.values()),
+        }
@@ -0,0 +1,141 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from cache import DAYS
+
+# iCalendar weekday codes in DAYS order
+ICAL_DAYS = {"MON": "MO", "TUE": "TU", "WED": "WE", "THU": "TH", "FRI": "FR", "SAT": "SA", "SUN": "SU"}
+
+PRODID = "-//telegrambot//Class Schedule//EN"
+
+
+def escape_text(text: str) -> str:
+    return (
+        str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+    )
+
+
+def fold(line: str) -> str:
+    # Content lines are at most 75 octets, continued on lines that start with a space
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def local_stamp(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def first_occurrence(day: str, anchor) -> datetime:
+    # The first date on or after anchor that falls on day, as a naive local midnight
+    date = anchor + timedelta(days=(DAYS.index(day) - anchor.weekday()) % 7)
+    return datetime(date.year, date.month, date.day)
+
+
+def vtimezone(tz, anchor) -> list:
+    # Asia/Dhaka has had no daylight saving since 2009, a single STANDARD block describes it
+    offset = tz.utcoffset(datetime(anchor.year, anchor.month, anchor.day))
+    minutes = int(offset.total_seconds() // 60)
+    sign = "+" if minutes >= 0 else "-"
+    tzoffset = f"{sign}{abs(minutes) // 60:02d}{abs(minutes) % 60:02d}"
+    return [
+        "BEGIN:VTIMEZONE",
+        f"TZID:{tz.zone}",
+        "BEGIN:STANDARD",
+        "DTSTART:19700101T000000",
+        f"TZOFFSETFROM:{tzoffset}",
+        f"TZOFFSETTO:{tzoffset}",
+        f"TZNAME:{tz.localize(datetime(anchor.year, anchor.month, anchor.day)).tzname()}",
+        "END:STANDARD",
+        "END:VTIMEZONE",
+    ]
+
+
+def build_calendar(chat_id, tz, anchor, classes, tests, vacation=None) -> bytes:
+    """
+    Render a chat's timetable as an iCalendar feed.
+    classes: (id, day, class_name, start_minute, end_minute), one weekly event each from the first week on or after anchor.
+    tests: (id, test_date, subject, details), all-day events.
+    vacation: a VacationState; while it is on and has dates, class occurrences inside it are excluded.
+    The output only depends on its arguments, so the same data always gives the same bytes.
+    """
+    # DTSTAMP must be UTC, so the anchor's local midnight is converted before it gets its Z
+    midnight = tz.localize(datetime(anchor.year, anchor.month, anchor.day))
+    dtstamp = local_stamp(midnight.astimezone(timezone.utc)) + "Z"
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:Class Schedule",
+        f"X-WR-TIMEZONE:{tz.zone}",
+        *vtimezone(tz, anchor),
+    ]
+
+    vacation_days = None
+    if vacation is not None and vacation.enabled and vacation.has_dates():
+        # Vacation runs from midnight of the start date to midnight of the end date
+        vacation_days = (vacation.start.date(), vacation.end.date())
+
+    for class_id, day, class_name, start_minute, end_minute in classes:
+        if day not in ICAL_DAYS or start_minute is None or end_minute is None:
+            continue
+        first = first_occurrence(day, anchor)
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:class-{class_id}-{chat_id}@telegrambot",
+            f"DTSTAMP:{dtstamp}",
+            f"DTSTART;TZID={tz.zone}:{local_stamp(first + timedelta(minutes=start_minute))}",
+            f"DTEND;TZID={tz.zone}:{local_stamp(first + timedelta(minutes=end_minute))}",
+            f"RRULE:FREQ=WEEKLY;BYDAY={ICAL_DAYS[day]}",
+            f"SUMMARY:{escape_text(class_name)}",
+        ]
+        if vacation_days:
+            start, end = vacation_days
+            occurrence = first_occurrence(day, max(start, first.date()))
+            exdates = []
+            while occurrence.date() < end:
+                exdates.append(local_stamp(occurrence + timedelta(minutes=start_minute)))
+                occurrence += timedelta(days=7)
+            if exdates:
+                lines.append(f"EXDATE;TZID={tz.zone}:{','.join(exdates)}")
+        lines.append("END:VEVENT")
+
+    for test_id, test_date, subject, details in tests:
+        try:
+            date = datetime.strptime(test_date, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            continue
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:test-{test_id}-{chat_id}@telegrambot",
+            f"DTSTAMP:{dtstamp}",
+            f"DTSTART;VALUE=DATE:{date.strftime('%Y%m%d')}",
+            f"DTEND;VALUE=DATE:{(date + timedelta(days=1)).strftime('%Y%m%d')}",
+            f"SUMMARY:{escape_text(f'📝 {subject}')}",
+            f"DESCRIPTION:{escape_text(details or '')}",
+            "END:VEVENT",
+        ]
+
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(fold(line) for line in lines) + "\r\n").encode("utf-8")
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    # Readers (and the file_id cache) never see a half-written feed
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
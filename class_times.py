@@ -0,0 +1,30 @@
+import re
+
+# 24-hour HH:MM (the hour may be a single digit, the minutes may not)
+TIME_PATTERN = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+# 12-hour display string for every minute of the day, e.g. TIME_12H[870] == "02:30 PM"
+TIME_12H = tuple(
+    f"{(minute // 60) % 12 or 12:02d}:{minute % 60:02d} {'AM' if minute < 720 else 'PM'}"
+    for minute in range(24 * 60)
+)
+
+
+def parse_time(time_str: str) -> int:
+    """Parse HH:MM into minutes since midnight, raising ValueError for anything else."""
+    match = TIME_PATTERN.match(time_str.strip())
+    if not match:
+        raise ValueError(f"Invalid time format: {time_str}")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def format_time(minute: int) -> str:
+    # Minutes since midnight back to the HH:MM stored in the text columns
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def display_time(minute) -> str:
+    # Rows that could not be migrated have no minutes
+    if minute is None:
+        return "Invalid time"
+    return TIME_12H[minute]
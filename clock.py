@@ -0,0 +1,56 @@
+import time
+from datetime import date, datetime, timedelta
+
+
+class Clock:
+    """
+    The bot's local time in one timezone.
+    Today's date, tomorrow and the next date of every weekday are computed once per day:
+    the first read after local midnight rolls them over, so no caller does tz math to get a date.
+    """
+
+    def __init__(self, tz):
+        self.tz = tz
+        self._midnights = {}  # date -> aware local midnight, for the dates asked for today
+        self._rollover = 0.0  # epoch seconds of the next local midnight
+        self._today = None
+        self._tomorrow = None
+        self._next_weekdays = ()
+
+    def _roll(self) -> None:
+        today = datetime.now(self.tz).date()
+        self._midnights.clear()
+        self._today = today
+        self._tomorrow = today + timedelta(days=1)
+        self._rollover = self.midnight(self._tomorrow).timestamp()
+        # Index by date.weekday(), MON = 0
+        self._next_weekdays = tuple(today + timedelta(days=(weekday - today.weekday()) % 7) for weekday in range(7))
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def today(self) -> date:
+        if time.time() >= self._rollover:
+            self._roll()
+        return self._today
+
+    def tomorrow(self) -> date:
+        if time.time() >= self._rollover:
+            self._roll()
+        return self._tomorrow
+
+    def next_weekday(self, weekday: int) -> date:
+        """The first date on or after today that falls on weekday (MON = 0)."""
+        if time.time() >= self._rollover:
+            self._roll()
+        return self._next_weekdays[weekday]
+
+    def midnight(self, day: date) -> datetime:
+        midnight = self._midnights.get(day)
+        if midnight is None:
+            midnight = self._midnights[day] = self.tz.localize(datetime(day.year, day.month, day.day))
+        return midnight
+
+    def at(self, day: date, minute: int) -> datetime:
+        # Aware local time minute minutes after the day's midnight, normalize fixes the offset across a DST change
+        return self.tz.normalize(self.midnight(day) + timedelta(minutes=minute))
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import DB_QUERY_SECONDS, DB_WAIT_SECONDS, DB_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Path to the SQLite database (can be overridden for local testing)
+DB_PATH = os.environ.get("SCHEDULE_DB", "schedule.db")
+
+# Number of pooled connections (and worker threads running queries)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+
+
+class Database:
+    """
+    Bounded pool of SQLite connections.
+    Queries run on a small worker thread pool so handlers never block the event loop.
+    """
+
+    def __init__(self, path: str = DB_PATH, pool_size: int = POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread is off because connections move between worker threads,
+        # the pool guarantees that only one thread uses a connection at a time.
+        # cached_statements keeps the prepared statements of the hot queries alive.
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Reuse an idle connection, open a new one while under the limit, otherwise wait
+        start = time.perf_counter()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.pool_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        DB_WAIT_SECONDS.observe(time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def call(self, fn, *args):
+        # Run fn(conn, *args) inside a transaction on the calling thread, timed under fn's name
+        operation = getattr(fn, "__name__", "call").lstrip("_")
+        if operation == "<lambda>":
+            operation = "call"
+        with self.connection() as conn:
+            start = time.perf_counter()
+            try:
+                with conn:
+                    return fn(conn, *args)
+            except sqlite3.Error as e:
+                DB_ERRORS.inc(operation, type(e).__name__)
+                raise
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation)
+
+    async def run(self, fn, *args):
+        # Run fn(conn, *args) inside a transaction on a worker thread
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.call, fn, *args)
+
+    async def fetchall(self, query: str, params=()) -> list:
+        return await self.run(_fetchall, query, params)
+
+    async def fetchone(self, query: str, params=()):
+        return await self.run(_fetchone, query, params)
+
+    async def execute(self, query: str, params=()) -> int:
+        # Returns the number of affected rows
+        return await self.run(_execute, query, params)
+
+    async def executemany(self, query: str, seq_of_params) -> int:
+        return await self.run(_executemany, query, seq_of_params)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+# Named so their time is recorded per operation
+def _fetchall(conn, query, params):
+    return conn.execute(query, params).fetchall()
+
+
+def _fetchone(conn, query, params):
+    return conn.execute(query, params).fetchone()
+
+
+def _execute(conn, query, params):
+    return conn.execute(query, params).rowcount
+
+
+def _executemany(conn, query, seq_of_params):
+    return conn.executemany(query, seq_of_params).rowcount
+
+
+_db = None
+
+
+# Shared database used by every handler
+def get_db() -> Database:
+    global _db
+    if _db is None:
+        _db = Database()
+    return _db
@@ -0,0 +1,396 @@
+"""
+Local stand-in for the Telegram Bot API, used to measure the bot without the real API.
+
+It starts bot_script.py against itself (on a copy of schedule.db), pushes synthetic
+updates through getUpdates (polling) or by POSTing them to the bot's webhook, and
+times how long each one takes to get its first reply.
+
+    python fake_telegram.py --mode polling --count 200
+    python fake_telegram.py --mode webhook --count 200 --concurrency 20
+
+Load test: /today latency while slow /hack sessions run in other chats
+
+    python fake_telegram.py --count 200 --concurrency 10 --hack-sessions 5
+    python fake_telegram.py --count 200 --concurrency 10 --hack-sessions 5 --concurrent-updates 1
+
+Mixed traffic at a steady rate is replayed by `python benchmarks.py load`.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOT_ID = 1000
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_body(content_type: str, body: bytes) -> dict:
+    # python-telegram-bot sends url-encoded forms, or multipart when a file is attached
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename() is None:
+                params[name] = part.get_content().strip() if part.get_content_maintype() == "text" else part.get_payload()
+            else:
+                params[name] = part.get_payload(decode=True)
+        return params
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def make_update(update_id: int, chat_id: int, text: str, document: dict = None) -> dict:
+    command_length = len(text.split()[0]) if text.startswith("/") else 0
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "Load test"},
+        "from": {"id": abs(chat_id), "is_bot": False, "first_name": "Load"},
+    }
+    # With a document the text is its caption
+    entities = [{"type": "bot_command", "offset": 0, "length": command_length}] if command_length else None
+    if document:
+        message.update(document=document, caption=text)
+        if entities:
+            message["caption_entities"] = entities
+    else:
+        message["text"] = text
+        if entities:
+            message["entities"] = entities
+    return {"update_id": update_id, "message": message}
+
+
+def make_callback_update(update_id: int, chat_id: int, data: str, message_id: int) -> dict:
+    # A press on an inline keyboard button under the bot's message message_id
+    chat = {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "Load test"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": abs(chat_id), "is_bot": False, "first_name": "Load"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": chat,
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Schedule Bot"},
+                "text": "",
+            },
+        },
+    }
+
+
+class FakeBotAPI:
+    """
+    Minimal Bot API: answers the methods the bot calls and records every outbound
+    message, so the time from injecting an update to the bot's reply can be measured.
+    """
+
+    def __init__(self):
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.file_ids = itertools.count(1)
+        self.condition = threading.Condition()
+        self.sent = {}           # chat_id -> injection time, waiting for the first reply
+        self.replies = {}        # chat_id -> threading.Event set on the first reply
+        self.latencies = []
+        self.calls = {}
+        self.files = {}          # file_id -> bytes, uploaded by the bot or by upload()
+        self.webhook = None
+        self.polling = threading.Event()
+        self.server = None
+
+    # ---- server side -------------------------------------------------------------
+
+    def start(self, port: int) -> str:
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive like the real API, the bot reuses its pooled connections
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                method = self.path.rsplit("/", 1)[-1]
+                params = parse_body(self.headers.get("Content-Type", ""), body)
+                payload = json.dumps(api.handle(method, params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if not self.path.startswith("/file/"):
+                    return self.do_POST()
+                # File downloads: /file/bot<token>/<file_path>, the file_path is the file_id
+                data = api.files.get(self.path.rsplit("/", 1)[-1])
+                self.send_response(200 if data is not None else 404)
+                self.send_header("Content-Length", str(len(data or b"")))
+                self.end_headers()
+                self.wfile.write(data or b"")
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # The default backlog of 5 drops connections under load and adds 1s SYN retries
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{port}/bot"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def handle(self, method: str, params: dict) -> dict:
+        self.calls[method] = self.calls.get(method, 0) + 1
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return {"ok": True, "result": True}
+        return handler(params)
+
+    def message(self, params: dict, **extra) -> dict:
+        chat_id = int(params["chat_id"])
+        self.record_reply(chat_id)
+        result = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "Load test"},
+            "from": {"id": BOT_ID, "is_bot": True, "first_name": "Schedule Bot", "username": "schedule_bot"},
+        }
+        if "text" in params:
+            result["text"] = params["text"]
+        result.update(extra)
+        return {"ok": True, "result": result}
+
+    def record_reply(self, chat_id: int):
+        sent_at = self.sent.pop(chat_id, None)
+        if sent_at is not None:
+            latency = time.perf_counter() - sent_at
+            self.latencies.append(latency)
+            # The waiting client reads its own latency from the event
+            replied = self.replies.pop(chat_id)
+            replied.latency = latency
+            replied.set()
+
+    def new_file(self) -> dict:
+        number = next(self.file_ids)
+        return {"file_id": f"fake-file-{number}", "file_unique_id": f"fake-unique-{number}"}
+
+    def api_getMe(self, params):
+        return {"ok": True, "result": {"id": BOT_ID, "is_bot": True, "first_name": "Schedule Bot", "username": "schedule_bot"}}
+
+    def api_setWebhook(self, params):
+        self.webhook = params.get("url")
+        return {"ok": True, "result": True}
+
+    def api_deleteWebhook(self, params):
+        self.webhook = None
+        return {"ok": True, "result": True}
+
+    def api_getUpdates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        with self.condition:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            if not self.updates:
+                self.condition.wait(timeout)
+            batch = self.updates[:100]
+        return {"ok": True, "result": batch}
+
+    def api_sendMessage(self, params):
+        return self.message(params)
+
+    def api_editMessageText(self, params):
+        return self.message(params)
+
+    def api_sendPhoto(self, params):
+        file = self.new_file()
+        return self.message(params, photo=[dict(file, width=800, height=600)])
+
+    def api_sendDocument(self, params):
+        file = self.new_file()
+        if isinstance(params.get("document"), bytes):
+            self.files[file["file_id"]] = params["document"]
+        return self.message(params, document=file)
+
+    def api_getFile(self, params):
+        file_id = params["file_id"]
+        data = self.files.get(file_id, b"")
+        return {"ok": True, "result": {"file_id": file_id, "file_unique_id": file_id, "file_size": len(data), "file_path": file_id}}
+
+    # ---- client side -------------------------------------------------------------
+
+    def upload(self, file_name: str, data: bytes) -> dict:
+        # A document as a user would send it, to pass to inject()
+        file = self.new_file()
+        self.files[file["file_id"]] = data
+        return dict(file, file_name=file_name, file_size=len(data))
+
+    def inject(self, chat_id: int, text: str, secret: str = None, document: dict = None) -> threading.Event:
+        return self.deliver(chat_id, make_update(next(self.update_ids), chat_id, text, document), secret)
+
+    def press(self, chat_id: int, data: str, message_id: int, secret: str = None) -> threading.Event:
+        # The reply is the edit (or new message) the button leads to
+        return self.deliver(chat_id, make_callback_update(next(self.update_ids), chat_id, data, message_id), secret)
+
+    def deliver(self, chat_id: int, update: dict, secret: str = None) -> threading.Event:
+        replied = threading.Event()
+        self.replies[chat_id] = replied
+        self.sent[chat_id] = time.perf_counter()
+        if self.webhook:
+            request = urllib.request.Request(
+                self.webhook, data=json.dumps(update).encode(), headers={"Content-Type": "application/json"}
+            )
+            if secret:
+                request.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+            urllib.request.urlopen(request, timeout=30).read()
+        else:
+            with self.condition:
+                self.updates.append(update)
+                self.condition.notify_all()
+        return replied
+
+
+def start_bot(api_url: str, mode: str, db_path: str, webhook_port: int, secret: str, extra_env: dict = None):
+    env = dict(
+        os.environ,
+        SCHEDULE_DB=db_path,
+        TELEGRAM_API_URL=api_url,
+        TELEGRAM_FILE_URL=api_url.replace("/bot", "/file/bot"),
+        BOT_TOKEN="123:fake",
+        BOT_MODE=mode,
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(webhook_port),
+        WEBHOOK_URL=f"http://127.0.0.1:{webhook_port}/telegram",
+        WEBHOOK_SECRET=secret,
+        METRICS_PORT="0",  # several bots may run at once, pass a free port in extra_env to scrape one
+    )
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "bot_script.py")],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_until_ready(api: FakeBotAPI, mode: str, webhook_port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if mode == "polling" and api.polling.is_set():
+            return
+        if mode == "webhook" and api.webhook:
+            try:
+                socket.create_connection(("127.0.0.1", webhook_port), timeout=1).close()
+                return
+            except OSError:
+                pass
+        time.sleep(0.1)
+    raise RuntimeError("The bot did not start in time")
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies: list) -> dict:
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def run(mode: str, count: int, concurrency: int, command: str, hack_sessions: int = 0, concurrent_updates: int = None) -> dict:
+    api = FakeBotAPI()
+    api_url = api.start(free_port())
+    webhook_port = free_port()
+    secret = "fake-secret"
+
+    workdir = tempfile.mkdtemp(prefix="fake-telegram-")
+    db_path = os.path.join(workdir, "schedule.db")
+    shutil.copy(os.path.join(HERE, "schedule.db"), db_path)
+    extra_env = {"CONCURRENT_UPDATES": str(concurrent_updates)} if concurrent_updates else None
+    bot = start_bot(api_url, mode, db_path, webhook_port, secret, extra_env)
+    try:
+        wait_until_ready(api, mode, webhook_port)
+
+        # Slow sessions in their own chats, running while the measured command is sent
+        for index in range(hack_sessions):
+            api.inject(-1_000_000 - index, "/hack target", secret).wait(30)
+        api.latencies.clear()
+
+        # Every request uses its own chat so replies can be matched to updates
+        def one(index: int):
+            api.inject(1_000_000 + index, command, secret).wait(30)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(count)))
+        elapsed = time.perf_counter() - started
+
+        result = summarize(api.latencies)
+        result.update(
+            mode=mode,
+            command=command,
+            hack_sessions=hack_sessions,
+            throughput_per_s=len(api.latencies) / elapsed,
+        )
+        return result
+    finally:
+        bot.terminate()
+        bot.wait(10)
+        api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the bot's reply latency against a fake Bot API.")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--count", type=int, default=100, help="number of updates to send")
+    parser.add_argument("--concurrency", type=int, default=1, help="updates in flight at once")
+    parser.add_argument("--command", default="/today")
+    parser.add_argument("--hack-sessions", type=int, default=0, help="/hack sessions running in other chats")
+    parser.add_argument("--concurrent-updates", type=int, help="CONCURRENT_UPDATES for the bot (1 = sequential)")
+    args = parser.parse_args()
+
+    result = run(args.mode, args.count, args.concurrency, args.command, args.hack_sessions, args.concurrent_updates)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
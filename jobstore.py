@@ -0,0 +1,94 @@
+import logging
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.util import datetime_to_utc_timestamp
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteJobStore(MemoryJobStore):
+    """
+    APScheduler job store persisted in the ScheduledJobs table of schedule.db.
+    Jobs are served from memory like MemoryJobStore; every change is written through
+    to SQLite and all jobs are loaded back with a single query when the scheduler starts.
+
+    APScheduler calls the store synchronously from the event loop, so changes are queued to a
+    single writer thread, which keeps them in order, and nobody waits for them. Only the load
+    in start() waits, it runs once in main() before the bot handles anything.
+    """
+
+    def __init__(self, pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.pickle_protocol = pickle_protocol
+        self._writer = None
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobstore")
+        rows = get_db().call(lambda conn: conn.execute("SELECT id, job_state FROM ScheduledJobs").fetchall())
+
+        jobs, broken = [], []
+        for job_id, job_state in rows:
+            try:
+                jobs.append(self._reconstitute_job(job_state))
+            except Exception:
+                logger.exception("Unable to restore job %s, removing it", job_id)
+                broken.append((job_id,))
+        if broken:
+            self._write(lambda conn: conn.executemany("DELETE FROM ScheduledJobs WHERE id = ?", broken))
+
+        # Build the sorted list in one go instead of inserting the jobs one by one
+        entries = [(job, datetime_to_utc_timestamp(job.next_run_time)) for job in jobs]
+        entries.sort(key=lambda entry: (float("inf") if entry[1] is None else entry[1], entry[0].id))
+        self._jobs = entries
+        self._jobs_index = {job.id: (job, timestamp) for job, timestamp in entries}
+        logger.info("Restored %d scheduled jobs", len(entries))
+
+    def _reconstitute_job(self, job_state: bytes) -> Job:
+        job = Job.__new__(Job)
+        job.__setstate__(pickle.loads(job_state))
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def _write(self, fn) -> None:
+        self._writer.submit(get_db().call, fn).add_done_callback(_log_failed_write)
+
+    def _save(self, query: str, job: Job) -> None:
+        next_run_time = datetime_to_utc_timestamp(job.next_run_time)
+        job_state = pickle.dumps(job.__getstate__(), self.pickle_protocol)
+        self._write(lambda conn: conn.execute(query, (next_run_time, job_state, job.id)))
+
+    def add_job(self, job):
+        super().add_job(job)
+        self._save("INSERT OR REPLACE INTO ScheduledJobs (next_run_time, job_state, id) VALUES (?, ?, ?)", job)
+
+    def update_job(self, job):
+        super().update_job(job)
+        self._save("UPDATE ScheduledJobs SET next_run_time = ?, job_state = ? WHERE id = ?", job)
+
+    def remove_job(self, job_id):
+        super().remove_job(job_id)
+        self._write(lambda conn: conn.execute("DELETE FROM ScheduledJobs WHERE id = ?", (job_id,)))
+
+    def remove_all_jobs(self):
+        super().remove_all_jobs()
+        self._write(lambda conn: conn.execute("DELETE FROM ScheduledJobs"))
+
+    def shutdown(self):
+        # Only forget the in-memory copy, the stored jobs must survive the restart
+        MemoryJobStore.remove_all_jobs(self)
+        # Let the queued writes finish before the database is closed
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+
+def _log_failed_write(future) -> None:
+    if future.exception() is not None:
+        logger.error("Writing a scheduled job to the database failed", exc_info=future.exception())
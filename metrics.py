@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a cache hit to a slow upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Every metric created below, in the order it is rendered
+REGISTRY = []
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A named family of series, one per combination of label values.
+    Updates come from the event loop and the database threads, so every series is changed under a lock.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> list:
+        # (name, labels, value) for every series
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + amount
+
+    def samples(self) -> list:
+        with self._lock:
+            series = list(self._series.items())
+        return [(self.name, dict(zip(self.labelnames, labelvalues)), value) for labelvalues, value in series]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labelvalues) -> None:
+        # Non-cumulative counts per bucket (the last one is +Inf), summed up when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def samples(self) -> list:
+        with self._lock:
+            series = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._series.items()]
+        samples = []
+        for labelvalues, counts, total in series:
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class CollectedMetric(Metric):
+    """
+    A metric read from state the bot already keeps (cache counters, registries) when it is scraped.
+    collect returns {labelvalues tuple: value}, it runs on the event loop like the code that owns that state.
+    """
+
+    def __init__(self, name: str, documentation: str, type: str, labelnames, collect):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self) -> list:
+        return [(self.name, dict(zip(self.labelnames, labelvalues)), value) for labelvalues, value in self.collect().items()]
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in each update handler.", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Exceptions raised by update handlers.", ["handler", "error"])
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "Time spent running database work, by operation.", ["operation"])
+DB_WAIT_SECONDS = Histogram("bot_db_pool_wait_seconds", "Time waiting for a pooled database connection.")
+DB_ERRORS = Counter("bot_db_errors_total", "Database errors, by operation.", ["operation", "error"])
+API_SECONDS = Histogram("bot_telegram_request_seconds", "Latency of outbound Bot API requests.", ["method"])
+API_ERRORS = Counter("bot_telegram_request_errors_total", "Failed outbound Bot API requests.", ["method", "error"])
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def timed(name: str, callback):
+    """Wrap a handler callback so its latency and exceptions are recorded under name."""
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, name)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument_handlers(application) -> None:
+    # Every registered handler, including the ones inside conversations, is timed under its callback's name
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument(handler)
+
+
+def _instrument(handler) -> None:
+    if isinstance(handler, ConversationHandler):
+        states = [inner for handlers in handler.states.values() for inner in handlers]
+        for inner in (*handler.entry_points, *states, *handler.fallbacks):
+            _instrument(inner)
+    elif not getattr(handler.callback, "timed", False):
+        handler.callback = timed(handler.callback.__name__, handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency and failures of every Bot API call."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple:
+        # File downloads carry the file path instead of an API method
+        api_method = "download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            status, body = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - start, api_method)
+        if status >= 400:
+            API_ERRORS.inc(api_method, f"HTTP {status}")
+        return status, body
+
+
+async def serve(host: str, port: int):
+    """Serve GET /metrics on the running event loop, returns the asyncio server."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the headers, the request has no body
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
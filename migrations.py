@@ -0,0 +1,219 @@
+import logging
+import os
+
+import queries
+from class_times import parse_time, format_time
+
+logger = logging.getLogger(__name__)
+
+# The group whose timetable this database held before every chat got its own
+LEGACY_CHAT_ID = int(os.environ.get("LEGACY_CHAT_ID", "-1002295712106"))
+
+
+# Migrations are applied in order and the last applied version is kept in PRAGMA user_version.
+# Never edit a migration that has shipped, append a new one instead.
+
+def create_base_schema(conn) -> None:
+    # The tables as they existed before migrations were tracked
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Classes (
+        id INTEGER PRIMARY KEY,
+        class_name TEXT,
+        day TEXT,
+        start_time TEXT,
+        end_time TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Vacation (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        toggle_mode INTEGER DEFAULT 0, -- 0 for off, 1 for on
+        start_date TEXT,              -- Start date in YYYY-MM-DD
+        end_date TEXT                 -- End date in YYYY-MM-DD
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ClassTests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        test_date TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        details TEXT
+    )
+    """)
+
+    # The vacation row is read with LIMIT 1 and must always exist
+    if conn.execute("SELECT COUNT(*) FROM Vacation").fetchone()[0] == 0:
+        conn.execute("INSERT INTO Vacation (toggle_mode) VALUES (0)")
+
+
+def add_class_minutes(conn) -> None:
+    # Store class times as minutes since midnight next to the original HH:MM text
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(Classes)")]
+    if "start_minute" not in columns:
+        conn.execute("ALTER TABLE Classes ADD COLUMN start_minute INTEGER")
+        conn.execute("ALTER TABLE Classes ADD COLUMN end_minute INTEGER")
+
+    updates = []
+    for class_id, start_time, end_time in conn.execute(
+        "SELECT id, start_time, end_time FROM Classes WHERE start_minute IS NULL"
+    ).fetchall():
+        try:
+            start_minute, end_minute = parse_time(start_time), parse_time(end_time)
+        except (ValueError, AttributeError):
+            logger.warning("Class %s has an invalid time (%s - %s), leaving it unconverted", class_id, start_time, end_time)
+            continue
+        updates.append((format_time(start_minute), format_time(end_minute), start_minute, end_minute, class_id))
+    conn.executemany(
+        "UPDATE Classes SET start_time = ?, end_time = ?, start_minute = ?, end_minute = ? WHERE id = ?", updates
+    )
+    logger.info("Converted %d class times to minutes", len(updates))
+
+
+def add_lookup_indexes(conn) -> None:
+    # Covering indexes: the day/date lookups are answered from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_classes_day_start ON Classes (day, start_minute, end_minute, class_name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_classtests_date ON ClassTests (test_date, subject, details)")
+
+
+def create_assets(conn) -> None:
+    # Telegram file_id of every uploaded file, by content hash and how it was sent (photo/document)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Assets (
+        sha256 TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        path TEXT,
+        uploaded_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (sha256, kind)
+    )
+    """)
+
+
+def create_subscriptions(conn) -> None:
+    # Chats that receive the daily digest, with the outcome of the last delivery
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Subscriptions (
+        chat_id INTEGER PRIMARY KEY,
+        active INTEGER NOT NULL DEFAULT 1,
+        subscribed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_status TEXT,              -- sent, blocked or failed
+        last_error TEXT,
+        last_attempt_at TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_active ON Subscriptions (active)")
+
+
+def create_scheduled_jobs(conn) -> None:
+    # Pickled APScheduler jobs (see jobstore.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ScheduledJobs (
+        id TEXT PRIMARY KEY,
+        next_run_time REAL,            -- UTC timestamp, NULL while paused
+        job_state BLOB NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduledjobs_next_run ON ScheduledJobs (next_run_time)")
+
+
+def add_chat_scope(conn) -> None:
+    # Classes, tests and vacations belong to a chat, the rows so far to the legacy group
+    for table in ("Classes", "ClassTests", "Vacation"):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if "chat_id" not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN chat_id INTEGER")
+        conn.execute(f"UPDATE {table} SET chat_id = ? WHERE chat_id IS NULL", (LEGACY_CHAT_ID,))
+
+    # One vacation row per chat, created on first use instead of seeded
+    conn.execute("DELETE FROM Vacation WHERE id NOT IN (SELECT MAX(id) FROM Vacation GROUP BY chat_id)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_vacation_chat ON Vacation (chat_id)")
+
+    # Lookups are per chat now, idx_classtests_date stays for the nightly cleanup across all chats
+    conn.execute("DROP INDEX IF EXISTS idx_classes_day_start")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_classes_chat_day_start ON Classes (chat_id, day, start_minute, end_minute, class_name)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_classtests_chat_date ON ClassTests (chat_id, test_date, subject, details)")
+
+
+def add_test_subject_index(conn) -> None:
+    # /ct <subject> matches the subject case-insensitively, the index has to use the same collation
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_classtests_chat_subject_date ON ClassTests (chat_id, subject COLLATE NOCASE, test_date)"
+    )
+
+
+def prune_superseded_assets(conn) -> None:
+    # Uploads used to pile up, every rebuilt calendar or timetable image left its file_id behind.
+    # Keep the latest upload of each path and kind (INSERT OR REPLACE gives it the highest rowid).
+    conn.execute("DELETE FROM Assets WHERE rowid NOT IN (SELECT MAX(rowid) FROM Assets GROUP BY path, kind)")
+
+
+MIGRATIONS = [
+    (1, "base schema", create_base_schema),
+    (2, "class times in minutes", add_class_minutes),
+    (3, "lookup indexes", add_lookup_indexes),
+    (4, "uploaded assets", create_assets),
+    (5, "digest subscriptions", create_subscriptions),
+    (6, "scheduled jobs", create_scheduled_jobs),
+    (7, "per-chat timetables", add_chat_scope),
+    (8, "test lookups by subject", add_test_subject_index),
+    (9, "prune superseded assets", prune_superseded_assets),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn) -> int:
+    """Apply every pending migration, each one in its own transaction. Returns the schema version."""
+    current = schema_version(conn)
+    if current > SCHEMA_VERSION:
+        logger.warning("Database schema version %d is newer than this bot (%d)", current, SCHEMA_VERSION)
+        return current
+
+    for version, name, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying migration %d: %s", version, name)
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN")
+        try:
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+    return current
+
+
+# The queries the bot runs most, checked by /db_plan
+HOT_QUERIES = {
+    "classes for day": (queries.CLASSES_FOR_DAY, (LEGACY_CHAT_ID, "MON")),
+    "timetable for chat": (queries.CLASSES_FOR_CHAT, (LEGACY_CHAT_ID,)),
+    "tests between dates": (queries.TESTS_BETWEEN_DATES, (LEGACY_CHAT_ID, "2024-01-01", "2024-01-07")),
+    "next tests": (queries.NEXT_TESTS, (LEGACY_CHAT_ID, "2024-01-01", "2024-01-07")),
+    "cleanup old tests": (queries.DELETE_OLD_TESTS, ("2024-01-01",)),
+    "list tests page": (
+        queries.TESTS_PAGE_AFTER, (LEGACY_CHAT_ID, "2024-01-01", "2024-01-01", "2024-01-01", 0, 11)
+    ),
+    "list tests page back": (
+        queries.TESTS_PAGE_BEFORE, (LEGACY_CHAT_ID, "2024-01-01", "2024-01-31", "2024-01-31", 99, 11)
+    ),
+    "tests for subject": (queries.TESTS_FOR_SUBJECT, (LEGACY_CHAT_ID, "Physics", "2024-01-01")),
+}
+
+
+def explain_hot_queries(conn) -> dict:
+    # name -> list of EXPLAIN QUERY PLAN detail lines
+    plans = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        plans[name] = [row[-1] for row in rows]
+    return plans
@@ -0,0 +1,40 @@
+# SQL of the hot paths, shared by the handlers in bot_script.py and by
+# migrations.HOT_QUERIES, so /db_plan explains exactly what the bot runs.
+
+# A chat's classes on one day, from idx_classes_chat_day_start
+CLASSES_FOR_DAY = (
+    "SELECT id, class_name, start_minute, end_minute FROM Classes WHERE chat_id = ? AND day = ? ORDER BY start_minute"
+)
+
+# A chat's whole timetable in one query
+CLASSES_FOR_CHAT = (
+    "SELECT id, day, class_name, start_minute, end_minute FROM Classes WHERE chat_id = ? ORDER BY day, start_minute"
+)
+
+# A chat's tests from one date through another, both inclusive, for the week view and the digest
+TESTS_BETWEEN_DATES = (
+    "SELECT test_date, subject, details FROM ClassTests WHERE chat_id = ? AND test_date BETWEEN ? AND ? ORDER BY test_date"
+)
+
+# The same range with the ids /ct shows, for /ct next Nd
+NEXT_TESTS = (
+    "SELECT id, test_date, subject, details FROM ClassTests "
+    "WHERE chat_id = ? AND test_date BETWEEN ? AND ? ORDER BY test_date, id"
+)
+
+# A chat's upcoming tests of one subject, in any case, from idx_classtests_chat_subject_date
+TESTS_FOR_SUBJECT = (
+    "SELECT id, test_date, subject, details FROM ClassTests "
+    "WHERE chat_id = ? AND subject = ? COLLATE NOCASE AND test_date >= ? ORDER BY test_date, id"
+)
+
+# Keyset pages of a chat's upcoming tests, after or before a (test_date, id) row key, see tests_page
+_TESTS_PAGE = "SELECT id, test_date, subject, details FROM ClassTests WHERE chat_id = ? AND test_date >= ?"
+TESTS_PAGE_AFTER = f"{_TESTS_PAGE} AND test_date >= ? AND (test_date > ? OR id > ?) ORDER BY test_date, id LIMIT ?"
+TESTS_PAGE_BEFORE = (
+    f"{_TESTS_PAGE} AND test_date <= ? AND (test_date < ? OR id < ?) ORDER BY test_date DESC, id DESC LIMIT ?"
+)
+
+# The nightly cleanup: the chats that had expired tests, then the delete
+CHATS_WITH_OLD_TESTS = "SELECT DISTINCT chat_id FROM ClassTests WHERE test_date < ?"
+DELETE_OLD_TESTS = "DELETE FROM ClassTests WHERE test_date < ?"
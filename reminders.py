@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = {"MON": 0, "TUE": 1, "WED": 2, "THU": 3, "FRI": 4, "SAT": 5, "SUN": 6}
+
+# Re-check the heap at least this often, so a clock change can't leave a reminder stuck
+MAX_SLEEP = 3600
+
+
+class ReminderWheel:
+    """
+    Fires a reminder lead_minutes before every class in every chat's timetable.
+    Upcoming reminders live in a heap ordered by firing time, and a single task sleeps
+    until the earliest one; changing a chat's day only touches that day's entries.
+    Due reminders are sent in their own tasks, so a slow or throttled send never holds up the heap.
+    """
+
+    def __init__(self, clock, lead_minutes: int, remind):
+        self.clock = clock
+        self.lead_minutes = lead_minutes
+        self.remind = remind        # async remind(chat_id, class_name, start_minute)
+        self._heap = []             # (fire_at, class_id, version)
+        self._classes = {}          # class_id -> (chat_id, day, class_name, start_minute, version)
+        self._by_day = {}           # (chat_id, day) -> class_ids in _classes
+        self._versions = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sending = set()       # reminder tasks still running
+        self.fired = 0
+        self.skipped = 0
+
+    def next_fire_time(self, day: str, start_minute: int, now: datetime) -> datetime:
+        if now.date() == self.clock.today():
+            date = self.clock.next_weekday(WEEKDAYS[day])
+        else:
+            date = now.date() + timedelta(days=(WEEKDAYS[day] - now.weekday()) % 7)
+        for extra_weeks in (0, 1):
+            fire_at = self.clock.at(date + timedelta(days=7 * extra_weeks), start_minute - self.lead_minutes)
+            if fire_at > now:
+                return fire_at
+        return fire_at
+
+    def _push(self, class_id, chat_id, day: str, class_name: str, start_minute: int, now: datetime) -> None:
+        if day not in WEEKDAYS or start_minute is None:
+            return
+        previous = self._classes.get(class_id)
+        if previous is not None and previous[:2] != (chat_id, day):
+            # The class moved to another day, set_day of its old day must not remove it
+            self._by_day[previous[:2]].discard(class_id)
+        self._versions += 1
+        self._classes[class_id] = (chat_id, day, class_name, start_minute, self._versions)
+        self._by_day.setdefault((chat_id, day), set()).add(class_id)
+        heapq.heappush(self._heap, (self.next_fire_time(day, start_minute, now), class_id, self._versions))
+
+    def set_day(self, chat_id, day: str, rows) -> None:
+        """Replace the classes of one chat's day with rows of (id, class_name, start_minute)."""
+        now = self.clock.now()
+        # Entries of removed classes stay in the heap and are skipped when they come up
+        for class_id in self._by_day.pop((chat_id, day), ()):
+            del self._classes[class_id]
+        for class_id, class_name, start_minute in rows:
+            self._push(class_id, chat_id, day, class_name, start_minute, now)
+        self._wakeup.set()
+
+    def load(self, rows) -> None:
+        """Build the heap from rows of (id, chat_id, day, class_name, start_minute)."""
+        now = self.clock.now()
+        self._heap.clear()
+        self._classes.clear()
+        self._by_day.clear()
+        for class_id, chat_id, day, class_name, start_minute in rows:
+            self._push(class_id, chat_id, day, class_name, start_minute, now)
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self.lead_minutes > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._sending:
+            task.cancel()
+        await asyncio.gather(*self._sending, return_exceptions=True)
+
+    async def _send(self, chat_id, class_name: str, start_minute: int) -> None:
+        try:
+            await self.remind(chat_id, class_name, start_minute)
+        except Exception:
+            logger.exception("Reminder for %s failed", class_name)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            # Drop entries of classes that were deleted or changed since they were pushed
+            while self._heap and self._classes.get(self._heap[0][1], (None,) * 5)[4] != self._heap[0][2]:
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            fire_at, class_id, version = self._heap[0]
+            delay = (fire_at - self.clock.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            chat_id, day, class_name, start_minute, _ = self._classes[class_id]
+            # Schedule next week's reminder before sending this one
+            self._push(class_id, chat_id, day, class_name, start_minute, fire_at + timedelta(minutes=1))
+            if -delay > self.lead_minutes * 60:
+                # Woke up after the class already started (e.g. the machine was suspended)
+                self.skipped += 1
+                logger.warning("Reminder for %s in chat %s skipped, it was due %.0f s ago", class_name, chat_id, -delay)
+                continue
+            self.fired += 1
+            task = asyncio.create_task(self._send(chat_id, class_name, start_minute))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
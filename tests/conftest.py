@@ -0,0 +1,19 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The bot's modules live at the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    # A fresh in-memory schedule.db at the current schema version
+    conn = sqlite3.connect(":memory:")
+    migrate(conn)
+    yield conn
+    conn.close()
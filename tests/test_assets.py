@@ -0,0 +1,25 @@
+from assets import store_file_id
+
+
+def rows(db) -> list:
+    return db.execute("SELECT path, kind, sha256, file_id FROM Assets ORDER BY path, kind").fetchall()
+
+
+def test_new_content_replaces_the_paths_earlier_uploads(db):
+    store_file_id(db, "old", "document", "f1", "calendars/1/schedule.ics")
+    store_file_id(db, "old", "photo", "f2", "calendars/1/schedule.ics")
+    store_file_id(db, "other", "document", "f3", "calendars/2/schedule.ics")
+
+    assert store_file_id(db, "new", "document", "f4", "calendars/1/schedule.ics") == ["old"]
+    assert rows(db) == [
+        ("calendars/1/schedule.ics", "document", "new", "f4"),
+        ("calendars/1/schedule.ics", "photo", "old", "f2"),
+        ("calendars/2/schedule.ics", "document", "other", "f3"),
+    ]
+
+
+def test_uploading_the_same_content_again_keeps_one_row(db):
+    store_file_id(db, "same", "photo", "f1", "timetables/1.png")
+
+    assert store_file_id(db, "same", "photo", "f2", "timetables/1.png") == []
+    assert rows(db) == [("timetables/1.png", "photo", "same", "f2")]
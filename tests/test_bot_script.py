@@ -0,0 +1,149 @@
+from datetime import date, timedelta
+
+from telegram.constants import MessageLimit
+
+# Reached through the module: imported by name, pytest would collect tests_page as a test
+import bot_script
+
+CHAT = 1
+TODAY = "2024-03-10"
+
+
+def test_short_text_is_one_message():
+    assert bot_script.split_message("MON\nPhysics\n\nTUE\nChemistry", limit=100) == ["MON\nPhysics\n\nTUE\nChemistry"]
+
+
+def test_splits_between_days_first():
+    days = ["MON\n" + "a" * 20, "TUE\n" + "b" * 20, "WED\n" + "c" * 20]
+
+    assert bot_script.split_message("\n\n".join(days), limit=50) == ["\n\n".join(days[:2]), days[2]]
+
+
+def test_a_day_longer_than_a_message_splits_between_lines():
+    day = "\n".join(f"class {i:02d}" for i in range(10))  # 10 lines of 8 characters
+
+    chunks = bot_script.split_message(day, limit=30)
+
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert "\n".join(chunks) == day
+    assert chunks[0] == "class 00\nclass 01\nclass 02"
+
+
+def test_a_line_longer_than_a_message_is_cut():
+    chunks = bot_script.split_message("short\n" + "x" * 25, limit=10)
+
+    assert chunks == ["short", "x" * 10, "x" * 10, "x" * 5]
+
+
+def add_tests(db, chat_id: int, dates: list) -> None:
+    db.executemany(
+        "INSERT INTO ClassTests (chat_id, test_date, subject, details) VALUES (?, ?, ?, ?)",
+        [(chat_id, test_date, f"S{i}", "") for i, test_date in enumerate(dates)],
+    )
+
+
+def upcoming(db) -> list:
+    return db.execute(
+        "SELECT id, test_date, subject, details FROM ClassTests WHERE chat_id = ? AND test_date >= ? ORDER BY test_date, id",
+        (CHAT, TODAY),
+    ).fetchall()
+
+
+def seed(db) -> list:
+    first = date.fromisoformat(TODAY)
+    # Three tests a day, so pages break inside a day, interleaved with expired tests and another chat's
+    add_tests(db, CHAT, [(first + timedelta(days=i // 3)).isoformat() for i in range(25)])
+    add_tests(db, CHAT, ["2024-03-01", "2024-03-09"])
+    add_tests(db, 2, [TODAY] * 5)
+    return upcoming(db)
+
+
+def test_pages_forward_through_every_upcoming_test(db):
+    expected = seed(db)
+
+    pages, cursor, has_next = [], None, True
+    while has_next:
+        rows, has_prev, has_next = bot_script.tests_page(db, CHAT, TODAY, cursor, forward=True, limit=10)
+        pages.append((rows, has_prev, has_next))
+        cursor = rows[-1][0]
+
+    assert pages == [
+        (expected[:10], False, True),
+        (expected[10:20], True, True),
+        (expected[20:], True, False),
+    ]
+
+
+def test_pages_backward_from_the_last_page(db):
+    expected = seed(db)
+    last, _, _ = bot_script.tests_page(db, CHAT, TODAY, expected[19][0], forward=True, limit=10)
+
+    rows, has_prev, has_next = bot_script.tests_page(db, CHAT, TODAY, last[0][0], forward=False, limit=10)
+
+    assert rows == expected[10:20]
+    assert (has_prev, has_next) == (True, True)
+
+
+def test_a_page_reflects_changes_since_the_cursor_was_made(db):
+    expected = seed(db)
+    # The first test on the second page is deleted before ▶️ is pressed
+    db.execute("DELETE FROM ClassTests WHERE id = ?", (expected[10][0],))
+
+    rows, _, _ = bot_script.tests_page(db, CHAT, TODAY, expected[9][0], forward=True, limit=10)
+
+    assert rows == expected[11:21]
+
+
+def test_going_back_past_the_start_shows_the_first_page(db):
+    expected = seed(db)
+    # Everything before the cursor has expired or been deleted
+    db.execute("DELETE FROM ClassTests WHERE id IN (?, ?)", (expected[0][0], expected[1][0]))
+
+    rows, has_prev, has_next = bot_script.tests_page(db, CHAT, TODAY, expected[2][0], forward=False, limit=10)
+
+    assert rows == expected[2:12]
+    assert (has_prev, has_next) == (False, True)
+
+
+def test_no_upcoming_tests(db):
+    add_tests(db, CHAT, ["2024-03-01"])
+
+    assert bot_script.tests_page(db, CHAT, TODAY) == ([], False, False)
+
+
+def test_a_deleted_cursor_starts_over_at_the_first_page(db):
+    expected = seed(db)
+    db.execute("DELETE FROM ClassTests WHERE id = ?", (expected[9][0],))
+
+    rows, has_prev, _ = bot_script.tests_page(db, CHAT, TODAY, expected[9][0], forward=True, limit=10)
+
+    assert rows == expected[:9] + expected[10:11]
+    assert not has_prev
+
+
+def long_tests(count: int, details_length: int) -> list:
+    return [(i, TODAY, "Physics", "x" * details_length) for i in range(1, count + 1)]
+
+
+def test_a_page_too_long_for_a_message_leaves_tests_for_the_next_one():
+    today = date.fromisoformat(TODAY)
+    rows = long_tests(10, 1000)
+
+    text, shown, has_prev, has_next = bot_script.fit_tests_page(rows, today, True, False, False)
+    assert len(text) <= MessageLimit.MAX_TEXT_LENGTH
+    assert shown == rows[:3]
+    assert (has_prev, has_next) == (False, True)
+
+    # Going back, the tests nearest the cursor stay and the earlier ones move to the previous page
+    text, shown, has_prev, has_next = bot_script.fit_tests_page(rows, today, False, False, True)
+    assert shown == rows[-3:]
+    assert (has_prev, has_next) == (True, True)
+
+
+def test_a_test_too_long_for_a_message_is_shortened():
+    today = date.fromisoformat(TODAY)
+
+    text, shown, _, _ = bot_script.fit_tests_page(long_tests(1, 5000), today, True, False, False)
+
+    assert len(text) == MessageLimit.MAX_TEXT_LENGTH
+    assert shown[0][3].endswith("…")
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+from telegram.error import NetworkError
+
+import broadcast
+from broadcast import MIN_CHAT_BUCKETS, Broadcaster, TokenBucket
+
+real_sleep = asyncio.sleep
+
+
+class FakeClock:
+    """Stands in for time.monotonic and asyncio.sleep in broadcast.py: sleeping moves the time on at once."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        # A real sleep always runs a little over, or a bucket just short of a token would wait forever
+        self.now += seconds + 1e-9
+        await real_sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(broadcast, "time", clock)
+    monkeypatch.setattr(broadcast.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def acquire_times(clock: FakeClock, bucket: TokenBucket, count: int) -> list:
+    # Seconds from the start until each of count acquisitions got its token
+    async def scenario():
+        started = clock.now
+        times = []
+        for _ in range(count):
+            await bucket.acquire()
+            times.append(clock.now - started)
+        return times
+
+    return asyncio.run(scenario())
+
+
+def test_allows_a_burst_of_capacity_then_the_rate(clock):
+    bucket = TokenBucket(rate=20, capacity=3)
+
+    # Then one token every 1 / 20 s
+    assert acquire_times(clock, bucket, 5) == pytest.approx([0, 0, 0, 0.05, 0.1])
+
+
+def test_concurrent_waiters_take_turns_at_the_rate(clock):
+    bucket = TokenBucket(rate=50, capacity=1)
+    order = []
+
+    async def waiter(number):
+        await bucket.acquire()
+        order.append(number)
+
+    async def scenario():
+        await asyncio.gather(*(waiter(number) for number in range(11)))
+
+    started = clock.now
+    asyncio.run(scenario())
+
+    # One token up front, the other ten at 50 per second, first come first served
+    assert order == list(range(11))
+    assert clock.now - started == pytest.approx(0.2)
+
+
+def test_pause_hands_out_nothing_until_it_ends(clock):
+    bucket = TokenBucket(rate=100, capacity=5)
+    bucket.pause(0.2)
+
+    assert acquire_times(clock, bucket, 1) == pytest.approx([0.2])
+
+
+class FailingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+        raise NetworkError("connection reset")
+
+
+def test_gives_up_without_backing_off_after_the_last_attempt(clock):
+    bot = FailingBot()
+    broadcaster = Broadcaster(max_attempts=4)
+
+    status = asyncio.run(broadcaster.send(bot, 1, "digest"))
+
+    assert status == ("failed", "connection reset")
+    assert len(bot.sent) == 4
+    assert broadcaster.retries == 3
+    # Backoffs between the attempts only, each one long enough to refill the chat's bucket
+    assert clock.sleeps == [1, 2, 4]
+
+
+class Bot:
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+
+def test_forgets_idle_chat_buckets(clock):
+    broadcaster = Broadcaster()
+
+    asyncio.run(broadcaster.broadcast(Bot(), {chat_id: "digest" for chat_id in range(4 * MIN_CHAT_BUCKETS)}))
+
+    # Only the chats messaged in the last second still need their buckets
+    assert len(broadcaster.chat_buckets) <= MIN_CHAT_BUCKETS
+    assert 4 * MIN_CHAT_BUCKETS - 1 in broadcaster.chat_buckets
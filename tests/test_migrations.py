@@ -0,0 +1,86 @@
+import sqlite3
+
+from migrations import LEGACY_CHAT_ID, MIGRATIONS, SCHEMA_VERSION, create_base_schema, migrate, schema_version
+
+
+def legacy_db():
+    # schedule.db as it was before migrations were tracked
+    conn = sqlite3.connect(":memory:")
+    create_base_schema(conn)
+    conn.executemany(
+        "INSERT INTO Classes (class_name, day, start_time, end_time) VALUES (?, ?, ?, ?)",
+        [("Physics", "MON", "8:00", "09:15"), ("Chemistry", "TUE", "soon", "10:00")],
+    )
+    conn.execute("INSERT INTO Vacation (toggle_mode, start_date, end_date) VALUES (1, '2024-01-01', '2024-01-07')")
+    conn.execute("INSERT INTO ClassTests (test_date, subject, details) VALUES ('2024-01-03', 'Physics', 'Ch 1')")
+    conn.commit()
+    return conn
+
+
+def index_names(conn) -> set:
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_migrates_a_legacy_database_to_the_current_schema():
+    conn = legacy_db()
+
+    assert migrate(conn) == SCHEMA_VERSION == 9
+    assert schema_version(conn) == SCHEMA_VERSION
+
+    # 2: times in minutes, the text normalized to HH:MM, rows that don't parse are left alone
+    assert conn.execute("SELECT class_name, start_time, start_minute, end_minute FROM Classes ORDER BY id").fetchall() == [
+        ("Physics", "08:00", 480, 555),
+        ("Chemistry", "soon", None, None),
+    ]
+    # 4-6: the new tables
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"Assets", "Subscriptions", "ScheduledJobs"} <= tables
+    # 7: the existing rows belong to the legacy group, one vacation row per chat
+    for table in ("Classes", "ClassTests", "Vacation"):
+        assert conn.execute(f"SELECT DISTINCT chat_id FROM {table}").fetchall() == [(LEGACY_CHAT_ID,)]
+    assert conn.execute("SELECT toggle_mode, start_date FROM Vacation").fetchall() == [(1, "2024-01-01")]
+    # 3, 7 and 8: the per-chat lookup indexes replace the global one for classes
+    indexes = index_names(conn)
+    assert {
+        "idx_classes_chat_day_start",
+        "idx_classtests_chat_date",
+        "idx_classtests_chat_subject_date",
+        "idx_classtests_date",
+        "idx_vacation_chat",
+    } <= indexes
+    assert "idx_classes_day_start" not in indexes
+
+
+def test_migrate_is_idempotent(db):
+    before = index_names(db)
+
+    assert migrate(db) == SCHEMA_VERSION
+    assert index_names(db) == before
+
+
+def test_resumes_from_the_last_applied_version():
+    conn = legacy_db()
+    for _, _, apply in MIGRATIONS[:6]:
+        apply(conn)
+    conn.executemany(
+        "INSERT INTO Assets (sha256, kind, file_id, path) VALUES (?, ?, ?, ?)",
+        [("a", "document", "1", "calendars/1/schedule.ics"), ("b", "document", "2", "calendars/1/schedule.ics"),
+         ("c", "document", "3", "syllabus.pdf"), ("c", "photo", "4", "syllabus.pdf")],
+    )
+    conn.execute("PRAGMA user_version = 6")
+    conn.commit()
+
+    assert migrate(conn) == SCHEMA_VERSION
+    # 7 to 9 ran on top of the earlier ones, 9 kept the latest upload of each path and kind
+    assert conn.execute("SELECT file_id FROM Assets ORDER BY file_id").fetchall() == [("2",), ("3",), ("4",)]
+    assert conn.execute("SELECT DISTINCT chat_id FROM Classes").fetchall() == [(LEGACY_CHAT_ID,)]
+    assert conn.execute("SELECT start_time, start_minute FROM Classes WHERE class_name = 'Physics'").fetchall() == [
+        ("08:00", 480)
+    ]
+    assert "idx_classtests_chat_subject_date" in index_names(conn)
+
+
+def test_leaves_a_newer_schema_alone(db):
+    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+
+    assert migrate(db) == SCHEMA_VERSION + 1
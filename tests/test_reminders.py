@@ -0,0 +1,108 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from clock import Clock
+from reminders import WEEKDAYS, ReminderWheel
+
+tz = pytz.timezone("Asia/Dhaka")
+
+
+class RunningClock(Clock):
+    """A Clock that starts at a chosen local time and then runs at real speed."""
+
+    def __init__(self, start: datetime):
+        super().__init__(tz)
+        self.start = start
+        self.started = time.monotonic()
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=time.monotonic() - self.started)
+
+    def today(self):
+        return self.now().date()
+
+    def next_weekday(self, weekday: int):
+        today = self.today()
+        return today + timedelta(days=(weekday - today.weekday()) % 7)
+
+
+def test_slow_reminder_does_not_hold_up_the_others():
+    # Monday 07:49:59.9, reminders for the 08:00 classes are due 10 minutes before
+    clock = RunningClock(tz.localize(datetime(2024, 1, 1, 7, 49, 59, 900000)))
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent = {}
+
+        async def remind(chat_id, class_name, start_minute):
+            if chat_id == 1:
+                await asyncio.sleep(1)  # e.g. backing off after a 429
+            sent[chat_id] = loop.time() - started
+
+        wheel = ReminderWheel(clock, 10, remind)
+        wheel.load([(1, 1, "MON", "Physics", 480), (2, 2, "MON", "Chemistry", 480)])
+        wheel.start()
+        await asyncio.sleep(0.5)
+        early = dict(sent)
+        await asyncio.sleep(1)
+        await wheel.stop()
+        return early, sent, wheel
+
+    early, sent, wheel = asyncio.run(scenario())
+
+    assert early.keys() == {2}
+    assert sent.keys() == {1, 2}
+    assert wheel.fired == 2
+
+
+def test_set_day_only_replaces_that_days_classes():
+    clock = RunningClock(tz.localize(datetime(2024, 1, 1, 7, 0)))
+    wheel = ReminderWheel(clock, 10, None)
+    wheel.load([(1, 1, "MON", "Physics", 480), (2, 1, "TUE", "Chemistry", 480), (3, 2, "MON", "Calculus", 600)])
+
+    wheel.set_day(1, "MON", [(4, "Programming", 540)])
+
+    assert set(wheel._classes) == {2, 3, 4}
+    assert wheel._by_day == {(1, "MON"): {4}, (1, "TUE"): {2}, (2, "MON"): {3}}
+
+
+def test_class_moved_to_another_day_survives_its_old_days_refresh():
+    clock = RunningClock(tz.localize(datetime(2024, 1, 1, 7, 0)))
+    wheel = ReminderWheel(clock, 10, None)
+    wheel.load([(1, 1, "MON", "Physics", 480)])
+
+    # Class 1 moves to Tuesday and the new day happens to be refreshed before the old one
+    wheel.set_day(1, "TUE", [(1, "Physics", 480)])
+    wheel.set_day(1, "MON", [])
+
+    assert wheel._classes[1][:2] == (1, "TUE")
+    assert wheel._by_day == {(1, "TUE"): {1}}
+
+
+def test_next_fire_time_is_lead_minutes_before_the_next_class():
+    wheel = ReminderWheel(Clock(tz), 10, None)
+    monday = tz.localize(datetime(2024, 1, 1, 7, 0))
+
+    # Later the same day, later in the week, and a class whose reminder is already past waits a week
+    assert wheel.next_fire_time("MON", 480, monday) == tz.localize(datetime(2024, 1, 1, 7, 50))
+    assert wheel.next_fire_time("WED", 540, monday) == tz.localize(datetime(2024, 1, 3, 8, 50))
+    assert wheel.next_fire_time("MON", 420, monday) == tz.localize(datetime(2024, 1, 8, 6, 50))
+    assert wheel.next_fire_time("SUN", 480, monday) == tz.localize(datetime(2024, 1, 7, 7, 50))
+
+
+def test_next_fire_time_from_the_clocks_today():
+    clock = Clock(tz)
+    wheel = ReminderWheel(clock, 10, None)
+    now = clock.now()
+    today = now.date()
+    day = list(WEEKDAYS)[today.weekday()]
+
+    # Today's midnight class is always past, its reminder is next week's
+    assert wheel.next_fire_time(day, 10, now) == clock.at(today + timedelta(days=7), 0)
+    # A class tomorrow at 23:59 is always ahead
+    tomorrow = today + timedelta(days=1)
+    assert wheel.next_fire_time(list(WEEKDAYS)[tomorrow.weekday()], 1439, now) == clock.at(tomorrow, 1429)
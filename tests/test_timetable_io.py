@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from timetable_io import MAX_REPORTED_ERRORS, export_csv, export_json, import_classes, parse_timetable, read_records
+
+CSV = "\ufeffday,class_name,start_time,end_time\nmon,Physics,8:00,09:15\nTUE, Chemistry ,10:00,11:00\n"
+
+
+def test_parses_csv_with_a_bom_and_loose_case():
+    assert parse_timetable(CSV.encode("utf-8"), "week.CSV") == [
+        ("MON", "Physics", 480, 555),
+        ("TUE", "Chemistry", 600, 660),
+    ]
+
+
+def test_parses_both_json_shapes():
+    classes = [{"day": "WED", "class_name": "Calculus", "start_time": "13:00", "end_time": "14:30"}]
+    expected = [("WED", "Calculus", 780, 870)]
+
+    assert parse_timetable(json.dumps(classes).encode(), "week.json") == expected
+    assert parse_timetable(json.dumps({"classes": classes}).encode(), "week.json") == expected
+
+
+@pytest.mark.parametrize(
+    "data, filename, message",
+    [
+        (b"day,class_name,start_time\nMON,Physics,08:00\n", "week.csv", "CSV header is missing: end_time"),
+        (b'{"classes": "none"}', "week.json", "JSON must be a list"),
+        (b"[1, 2]", "week.json", "JSON must be a list"),
+        (b"MON Physics 08:00 09:00", "week.txt", "Send a .csv or .json file"),
+    ],
+)
+def test_rejects_unreadable_files(data, filename, message):
+    with pytest.raises(ValueError, match=message):
+        read_records(data, filename)
+
+
+def test_reports_every_bad_row_and_imports_nothing():
+    data = (
+        "day,class_name,start_time,end_time\n"
+        "MON,Physics,08:00,09:00\n"
+        "FUNDAY,Chemistry,08:00,09:00\n"
+        "TUE,,08:00,09:00\n"
+        "WED,Calculus,25:00,26:00\n"
+        "THU,EEE,10:00,09:00\n"
+    )
+    with pytest.raises(ValueError) as error:
+        parse_timetable(data.encode(), "week.csv")
+
+    assert str(error.value).splitlines() == [
+        "Row 2: invalid day 'FUNDAY'",
+        "Row 3: missing class_name",
+        "Row 4: Invalid time format: 25:00",
+        "Row 5: end_time must be after start_time",
+    ]
+
+
+def test_summarizes_errors_past_the_limit():
+    records = [{"day": "MON", "class_name": "Physics", "start_time": "later", "end_time": "09:00"}] * 15
+    with pytest.raises(ValueError) as error:
+        parse_timetable(json.dumps(records).encode(), "week.json")
+
+    lines = str(error.value).splitlines()
+    assert len(lines) == MAX_REPORTED_ERRORS + 1
+    assert lines[-1] == f"... and {15 - MAX_REPORTED_ERRORS} more"
+
+
+def test_rejects_an_empty_timetable():
+    with pytest.raises(ValueError, match="no classes"):
+        parse_timetable(b"day,class_name,start_time,end_time\n", "week.csv")
+
+
+def test_export_round_trips_and_skips_unmigrated_times():
+    timetable = {"MON": [("Physics", 480, 555), ("Broken", None, None)], "FRI": [("Chemistry", 600, 660)]}
+    expected = [("MON", "Physics", 480, 555), ("FRI", "Chemistry", 600, 660)]
+
+    assert parse_timetable(export_csv(timetable), "export.csv") == expected
+    assert parse_timetable(export_json(timetable), "export.json") == expected
+
+
+def test_import_replaces_only_that_chats_classes(db):
+    import_classes(db, 1, [("MON", "Physics", 480, 555)])
+    import_classes(db, 2, [("MON", "Calculus", 600, 660)])
+
+    assert import_classes(db, 1, [("TUE", "Chemistry", 600, 660)], replace=True) == 1
+    assert db.execute("SELECT chat_id, day, class_name, start_time, end_minute FROM Classes ORDER BY chat_id").fetchall() == [
+        (1, "TUE", "Chemistry", "10:00", 660),
+        (2, "MON", "Calculus", "10:00", 660),
+    ]
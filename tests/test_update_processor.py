@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from update_processor import PerChatUpdateProcessor
+
+CHAT_A = -100
+CHAT_B = -200
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type=Chat.GROUP)
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=datetime.now(), chat=chat))
+
+
+def run_updates(max_concurrent_updates: int, updates: list) -> tuple:
+    # updates: (update, name, times the handler yields to the loop); returns (start/end events, processor)
+    async def scenario():
+        processor = PerChatUpdateProcessor(max_concurrent_updates)
+        events = []
+
+        async def handler(name, yields):
+            events.append(f"start {name}")
+            for _ in range(yields):
+                await asyncio.sleep(0)
+            events.append(f"end {name}")
+
+        await asyncio.gather(*(processor.process_update(update, handler(name, yields)) for update, name, yields in updates))
+        return events, processor
+
+    return asyncio.run(scenario())
+
+
+def test_backlog_in_one_chat_does_not_delay_another():
+    async def scenario():
+        # As many updates from chat A as there are slots, each one stuck until released
+        processor = PerChatUpdateProcessor(4)
+        release = asyncio.Event()
+        events = []
+
+        async def stuck(name):
+            events.append(f"start {name}")
+            await release.wait()
+            events.append(f"end {name}")
+
+        async def quick():
+            events.append("b")
+
+        backlog = [asyncio.create_task(processor.process_update(make_update(i, CHAT_A), stuck(f"a{i}"))) for i in range(4)]
+        # Chat B's update must get through while a0 is still stuck, the timeout only guards against a hang
+        await asyncio.wait_for(processor.process_update(make_update(4, CHAT_B), quick()), timeout=5)
+        release.set()
+        await asyncio.gather(*backlog)
+        return events
+
+    events = asyncio.run(scenario())
+
+    # Chat A's updates still ran one after another
+    assert events == ["start a0", "b", "end a0"] + [f"{event} a{i}" for i in range(1, 4) for event in ("start", "end")]
+
+
+def test_updates_of_a_chat_run_in_arrival_order():
+    # Later updates yield less, they would finish first if they overlapped
+    updates = [(make_update(i, CHAT_A), f"a{i}", 5 - i) for i in range(5)]
+
+    events, _ = run_updates(8, updates)
+
+    assert events == [f"{event} a{i}" for i in range(5) for event in ("start", "end")]
+
+
+def test_idle_chats_are_forgotten():
+    updates = [(make_update(i, chat_id), str(i), 0) for i, chat_id in enumerate([CHAT_A, CHAT_B, CHAT_A])]
+
+    _, processor = run_updates(2, updates)
+
+    assert processor._locks == {}
+    assert processor._users == {}
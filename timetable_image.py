@@ -0,0 +1,125 @@
+import io
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow missing, the bot falls back to the static schedule.png
+    Image = None
+
+# Columns in the order of the teaching week, Friday only when it has classes
+WEEK_DAYS = ["SAT", "SUN", "MON", "TUE", "WED", "THU", "FRI"]
+DAY_NAMES = {"SAT": "Saturday", "SUN": "Sunday", "MON": "Monday", "TUE": "Tuesday",
+             "WED": "Wednesday", "THU": "Thursday", "FRI": "Friday"}
+
+# Block colour for each course emoji, other courses get one from PALETTE by name
+EMOJI_COLOURS = {
+    "🧪": "#4caf50",   # chemistry
+    "💻": "#2196f3",   # programming
+    "🧮": "#ff9800",   # calculus
+    "⚡": "#c79100",   # EEE
+    "⚛️": "#9c27b0",   # physics
+}
+PALETTE = ["#26a69a", "#ef5350", "#7e57c2", "#8d6e63", "#5c6bc0", "#ec407a", "#78909c"]
+
+BACKGROUND = "#ffffff"
+GRID = "#e0e0e0"
+TEXT = "#212121"
+
+TIME_COLUMN = 70
+DAY_WIDTH = 170
+HEADER_HEIGHT = 50
+HOUR_HEIGHT = 72
+PADDING = 6
+
+
+def course_colours(class_names, course_emojis: dict) -> dict:
+    # class_name -> colour, decided in the bot process so the worker needs no bot state
+    colours = {}
+    for class_name in class_names:
+        emoji = course_emojis.get(class_name)
+        if emoji in EMOJI_COLOURS:
+            colours[class_name] = EMOJI_COLOURS[emoji]
+        else:
+            colours[class_name] = PALETTE[sum(map(ord, class_name)) % len(PALETTE)]
+    return colours
+
+
+def load_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single bitmap size
+        return ImageFont.load_default()
+
+
+def wrap(draw, text: str, font, width: int) -> list:
+    lines, current = [], ""
+    for word in text.split():
+        candidate = f"{current} {word}".strip()
+        if current and draw.textlength(candidate, font=font) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def render_timetable(timetable: dict, colours: dict, title: str) -> bytes:
+    """
+    Draw the week grid as PNG bytes.
+    timetable: day -> sorted (class_name, start_minute, end_minute), colours: class_name -> "#rrggbb".
+    Runs in a worker process, so the arguments and the result are plain picklable values.
+    """
+    days = [day for day in WEEK_DAYS if day != "FRI" or timetable.get(day)]
+    minutes = [minute for classes in timetable.values() for _, start, end in classes
+               if start is not None and end is not None for minute in (start, end)]
+    first_hour = min(minutes) // 60 if minutes else 8
+    last_hour = -(-max(minutes) // 60) if minutes else 17
+    hours = max(last_hour - first_hour, 1)
+
+    width = TIME_COLUMN + DAY_WIDTH * len(days)
+    # Room below the grid for the last hour label
+    height = HEADER_HEIGHT * 2 + HOUR_HEIGHT * hours + HEADER_HEIGHT // 2
+    image = Image.new("RGB", (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    title_font, header_font, font = load_font(22), load_font(16), load_font(13)
+
+    draw.text((width // 2, HEADER_HEIGHT // 2), title, fill=TEXT, font=title_font, anchor="mm")
+    top = HEADER_HEIGHT * 2
+
+    # Day headers and hour lines
+    for index, day in enumerate(days):
+        x = TIME_COLUMN + DAY_WIDTH * index
+        draw.text((x + DAY_WIDTH // 2, HEADER_HEIGHT + HEADER_HEIGHT // 2), DAY_NAMES[day],
+                  fill=TEXT, font=header_font, anchor="mm")
+        draw.line([(x, HEADER_HEIGHT), (x, top + HOUR_HEIGHT * hours)], fill=GRID)
+    for hour in range(hours + 1):
+        y = top + HOUR_HEIGHT * hour
+        draw.line([(TIME_COLUMN, y), (width, y)], fill=GRID)
+        # The grid can end at midnight (hour 24), both parts of the label come from the hour of the day
+        hour_of_day = (first_hour + hour) % 24
+        label = f"{hour_of_day % 12 or 12} {'AM' if hour_of_day < 12 else 'PM'}"
+        draw.text((TIME_COLUMN - PADDING, y), label, fill=TEXT, font=font, anchor="rm")
+
+    # One block per class, from its start to its end time
+    for index, day in enumerate(days):
+        x = TIME_COLUMN + DAY_WIDTH * index
+        for class_name, start, end in timetable.get(day, ()):
+            if start is None or end is None:
+                continue
+            y0 = top + (start - first_hour * 60) * HOUR_HEIGHT // 60
+            y1 = top + (end - first_hour * 60) * HOUR_HEIGHT // 60
+            draw.rounded_rectangle([(x + 3, y0 + 2), (x + DAY_WIDTH - 3, y1 - 2)], radius=6,
+                                   fill=colours.get(class_name, PALETTE[0]))
+            times = f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+            lines = [times] + wrap(draw, class_name, font, DAY_WIDTH - 2 * PADDING - 6)
+            line_height = font.size + 3 if hasattr(font, "size") else 14
+            for number, line in enumerate(lines):
+                y = y0 + PADDING + number * line_height
+                if y + line_height > y1:
+                    break
+                draw.text((x + PADDING + 3, y), line, fill=BACKGROUND, font=font)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
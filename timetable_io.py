@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+
+from cache import DAYS
+from class_times import parse_time, format_time
+
+# Columns of an imported or exported timetable, times are 24-hour HH:MM
+FIELDS = ("day", "class_name", "start_time", "end_time")
+
+# Problems listed back to the user before the rest are summarized
+MAX_REPORTED_ERRORS = 10
+
+
+def read_records(data: bytes, filename: str) -> list:
+    """Decode an uploaded .csv or .json file into dicts with the FIELDS keys."""
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        records = json.loads(text)
+        # Either a list of classes or the {"classes": [...]} written by export_json
+        if isinstance(records, dict):
+            records = records.get("classes")
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError('JSON must be a list of classes or {"classes": [...]}')
+        return records
+    if filename.lower().endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        try:
+            missing = [field for field in FIELDS if field not in (reader.fieldnames or ())]
+            if missing:
+                raise ValueError(f"CSV header is missing: {', '.join(missing)}")
+            return list(reader)
+        except csv.Error as e:
+            raise ValueError(f"Invalid CSV: {e}") from e
+    raise ValueError("Send a .csv or .json file")
+
+
+def validate_records(records) -> list:
+    """
+    Turn records into (day, class_name, start_minute, end_minute) rows.
+    Every record is checked before anything is returned, so one bad row rejects the whole file.
+    """
+    rows, errors = [], []
+    for number, record in enumerate(records, start=1):
+        day = str(record.get("day") or "").strip().upper()
+        class_name = str(record.get("class_name") or "").strip()
+        try:
+            if day not in DAYS:
+                raise ValueError(f"invalid day {day!r}")
+            if not class_name:
+                raise ValueError("missing class_name")
+            start_minute = parse_time(str(record.get("start_time") or ""))
+            end_minute = parse_time(str(record.get("end_time") or ""))
+            if end_minute <= start_minute:
+                raise ValueError("end_time must be after start_time")
+        except ValueError as e:
+            errors.append(f"Row {number}: {e}")
+            continue
+        rows.append((day, class_name, start_minute, end_minute))
+
+    if errors:
+        more = len(errors) - MAX_REPORTED_ERRORS
+        raise ValueError("\n".join(errors[:MAX_REPORTED_ERRORS]) + (f"\n... and {more} more" if more > 0 else ""))
+    if not rows:
+        raise ValueError("The file has no classes")
+    return rows
+
+
+def parse_timetable(data: bytes, filename: str) -> list:
+    return validate_records(read_records(data, filename))
+
+
+def import_classes(conn, chat_id: int, rows, replace: bool = False) -> int:
+    """Insert rows for a chat with one executemany, run inside a single transaction (Database.run)."""
+    if replace:
+        conn.execute("DELETE FROM Classes WHERE chat_id = ?", (chat_id,))
+    conn.executemany(
+        "INSERT INTO Classes (chat_id, day, class_name, start_time, end_time, start_minute, end_minute) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (chat_id, day, class_name, format_time(start_minute), format_time(end_minute), start_minute, end_minute)
+            for day, class_name, start_minute, end_minute in rows
+        ],
+    )
+    return len(rows)
+
+
+def export_records(timetable: dict) -> list:
+    # timetable: day -> sorted (class_name, start_minute, end_minute), as cached for the chat
+    return [
+        {"day": day, "class_name": class_name, "start_time": format_time(start_minute), "end_time": format_time(end_minute)}
+        for day in DAYS
+        for class_name, start_minute, end_minute in timetable.get(day, ())
+        if start_minute is not None and end_minute is not None
+    ]
+
+
+def export_csv(timetable: dict) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(export_records(timetable))
+    return buffer.getvalue().encode("utf-8")
+
+
+def export_json(timetable: dict) -> bytes:
+    return json.dumps({"classes": export_records(timetable)}, ensure_ascii=False, indent=2).encode("utf-8")
@@ -0,0 +1,48 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently, but updates from the same chat
+    one at a time and in the order they arrived. That keeps a slow handler (/hack, /clear)
+    from blocking other chats while the add/delete schedule conversations still see their
+    messages in order.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._users = {}
+
+    async def process_update(self, update, coroutine) -> None:
+        # The chat lock comes before the concurrency slot: an update waiting behind its own
+        # chat must not hold one of max_concurrent_updates slots that other chats could use
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        # asyncio.Lock wakes waiters in FIFO order, which preserves the chat's update order
+        lock = self._locks.setdefault(chat.id, asyncio.Lock())
+        self._users[chat.id] = self._users.get(chat.id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Forget idle chats so the lock table doesn't grow with every chat ever seen
+            self._users[chat.id] -= 1
+            if not self._users[chat.id]:
+                del self._users[chat.id]
+                del self._locks[chat.id]
+
+    async def do_process_update(self, update, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
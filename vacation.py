@@ -1,56 +1,72 @@
-# import sqlite3
+import logging
+import sqlite3
+from datetime import datetime
 
-# def add_vacation_table():
-#     conn = sqlite3.connect("schedule.db")
-#     cursor = conn.cursor()
+from database import DB_PATH
+from migrations import migrate
 
-#     # Create Vacation table
-#     cursor.execute("""
-#     CREATE TABLE IF NOT EXISTS Vacation (
-#         id INTEGER PRIMARY KEY AUTOINCREMENT,
-#         toggle_mode INTEGER DEFAULT 0, -- 0 for off, 1 for on
-#         start_date TEXT,              -- Start date in YYYY-MM-DD
-#         end_date TEXT                 -- End date in YYYY-MM-DD
-#     )
-#     """)
+logger = logging.getLogger(__name__)
 
-#     # Initialize a row if it doesn't exist
-#     cursor.execute("SELECT COUNT(*) FROM Vacation")
-#     if cursor.fetchone()[0] == 0:
-#         cursor.execute("INSERT INTO Vacation (toggle_mode) VALUES (0)")
+VACATION_OVER_MESSAGE = "🎉 Vacation is over! 🏫 Time to get back to studying! 🎓"
 
-#     conn.commit()
-#     conn.close()
 
-# add_vacation_table()
+class VacationState:
+    """
+    In-memory copy of a chat's Vacation row.
+    Dates are parsed and localized once when the row is loaded or changed.
+    """
 
+    def __init__(self, tz, toggle_mode: int = 0, start_date: str = None, end_date: str = None):
+        self.tz = tz
+        self.update(toggle_mode, start_date, end_date)
 
-import sqlite3
+    def update(self, toggle_mode: int, start_date: str = None, end_date: str = None) -> None:
+        self.toggle_mode = toggle_mode
+        self.start_date = start_date
+        self.end_date = end_date
+        # Vacation runs from midnight of the start date to midnight of the end date (GMT+6)
+        self.start = self.tz.localize(datetime.strptime(start_date, "%Y-%m-%d")) if start_date else None
+        self.end = self.tz.localize(datetime.strptime(end_date, "%Y-%m-%d")) if end_date else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.toggle_mode == 1
+
+    def has_dates(self) -> bool:
+        return self.start is not None and self.end is not None
+
+    def status(self, now: datetime) -> tuple[bool, str]:
+        # Same answers as the old database-backed is_vacation, without touching the database
+        if not self.enabled:
+            return False, ""
+
+        if self.has_dates():
+            # Check if today's date is within the vacation period
+            if self.start <= now <= self.end:
+                # Calculate the remaining time
+                delta = self.end - now
+                days_remaining = delta.days
+                hours_remaining = delta.seconds // 3600  # Remaining hours after days
+                return True, f"🎉🌴 Vacation mode: ON! No alarms, no stress, just chilling. 😎🛀\nYou've got {days_remaining} day(s) and {hours_remaining} hour(s) before the fun ends—make it count! ⏳\nAnd hey, don’t bother me, I’m on vacation too! But seriously, get that homework done before it’s too late. 📝😂"
 
-def rebuild_vacation_table():
-    conn = sqlite3.connect("schedule.db")
-    cursor = conn.cursor()
-
-    # Drop the existing Vacation table if it exists
-    cursor.execute("DROP TABLE IF EXISTS Vacation")
-
-    # Recreate the Vacation table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Vacation (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        toggle_mode INTEGER DEFAULT 0, -- 0 for off, 1 for on
-        start_date TEXT,              -- Start date in YYYY-MM-DD
-        end_date TEXT                 -- End date in YYYY-MM-DD
-    )
-    """)
-
-    # Insert a row to initialize it
-    cursor.execute("INSERT INTO Vacation (toggle_mode) VALUES (0)")
-    conn.commit()
+            # The end-of-vacation job turns the mode off, until it has run treat it as over
+            if now > self.end:
+                return False, VACATION_OVER_MESSAGE
+
+        return True, "🎉🌴 Vacation mode: ON! No alarms, no stress, just chilling.! The classes are on vacation, and so am I! 😎🎉"
+
+
+# The Vacation table itself is created by the migrations, this only turns every chat's vacation off
+def reset_vacation():
+    conn = sqlite3.connect(DB_PATH)
+    migrate(conn)
+
+    with conn:
+        conn.execute("UPDATE Vacation SET toggle_mode = 0, start_date = NULL, end_date = NULL")
     conn.close()
 
-    print("Vacation table has been rebuilt and initialized.")
+    logger.info("Vacation has been reset and turned off.")
 
 if __name__ == "__main__":
-    rebuild_vacation_table()
-
+    logging.basicConfig(level=logging.INFO)
+    reset_vacation()